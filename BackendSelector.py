@@ -0,0 +1,131 @@
+import hashlib
+import importlib.util
+import json
+import os
+import platform
+from pathlib import Path
+
+import torch
+
+# Backend: (export.py --include format, artifact suffix, OpenCV DNN)
+BACKENDS = {
+    'PyTorch': (None, '.pt', False),
+    'TorchScript': ('torchscript', '.torchscript', False),
+    'ONNX Runtime': ('onnx', '.onnx', False),
+    'OpenVINO': ('openvino', '_openvino_model', False),
+    'OpenCV DNN': ('onnx', '.onnx', True),}
+
+# Backend: modules its export and inference need. YOLOv5 pip installs missing requirements, a backend whose runtime is
+# not installed is skipped before it gets that far
+RUNTIMES = {
+    'PyTorch': (),
+    'TorchScript': (),
+    'ONNX Runtime': ('onnx', 'onnxruntime'),
+    'OpenVINO': ('onnx', 'openvino', 'openvino.tools.mo'),
+    'OpenCV DNN': ('onnx',),}
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def machine_id():
+    return f'{platform.node()}|{platform.processor()}|{os.cpu_count()} cpus|torch {torch.__version__}'
+
+
+def installed(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:  # parent package of a submodule is missing
+        return False
+
+
+# Path of the exported model for backend, exported next to the weights if it is missing or older than the weights,
+# None if the runtime of the backend is not installed or the export failed
+def artifact(weights, backend, imgsz):
+    fmt, suffix, _ = BACKENDS[backend]
+    if not all(installed(m) for m in RUNTIMES[backend]):
+        return None
+    if fmt is None:
+        return weights
+    w = Path(weights)
+    f = w.parent / f'{w.stem}{suffix}' if suffix.startswith('_') else w.with_suffix(suffix)
+    if not f.exists() or f.stat().st_mtime < w.stat().st_mtime:
+        from export import run as export_run  # heavy import, only needed when exporting
+        export_run(weights=weights, imgsz=list(imgsz), include=(fmt,), verify=False)  # benchmarked by select()
+    return str(f) if f.exists() else None
+
+
+class BackendSelector:
+
+    def __init__(self, cache_file, n=10) -> None:
+
+        self.cache_file = cache_file  # json of backend timings per machine, model hash and image size
+        self.n = n  # timed inferences per backend
+        self.timings = {}  # backend: ms per frame of the last selection
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def save_cache(self, cache):
+        try:
+            with open(self.cache_file, 'w') as f:
+                json.dump(cache, f, indent=2)
+        except Exception as e:
+            print(f'Backend benchmark cache not saved: {e}')
+
+    # Build the detector on the fastest backend for this machine, or on the pinned backend.
+    # make_detector(weights, dnn=None) returns a Detector with the caller's settings, progress(message) reports each step
+    def select(self, weights, make_detector, imgsz, pin='auto', progress=None):
+        if not str(weights).endswith('.pt'):
+            return make_detector(weights)  # exported models run on their own backend
+
+        if pin != 'auto':
+            _, _, dnn = BACKENDS[pin]
+            f = artifact(weights, pin, imgsz)
+            if f is None:
+                missing = [m for m in RUNTIMES[pin] if not installed(m)]
+                raise Exception(f'{pin} requires {", ".join(missing)}' if missing else f'{pin} export failed')
+            return make_detector(f, dnn)
+
+        cache = self.load_cache()
+        key = f'{machine_id()}|{file_hash(weights)}|{imgsz[0]}x{imgsz[1]}'
+        if key in cache:
+            self.timings = cache[key]
+            for backend in sorted((b for b, t in self.timings.items() if t is not None), key=self.timings.get):
+                try:
+                    _, _, dnn = BACKENDS[backend]
+                    f = artifact(weights, backend, imgsz)
+                    if f is not None:
+                        return make_detector(f, dnn)
+                except Exception as e:
+                    print(f'{backend} unavailable: {e}')
+
+        # Time every backend available on this machine and keep the fastest
+        best, self.timings = None, {}
+        for backend, (_, _, dnn) in BACKENDS.items():
+            if progress: progress(f'Benchmarking {backend}...')
+            try:
+                f = artifact(weights, backend, imgsz)
+                if f is None:
+                    raise Exception('runtime not installed or export failed')
+                detector = make_detector(f, dnn)
+                self.timings[backend] = detector.benchmark(self.n) * 1E3
+                if best is None or self.timings[backend] < best.latency * 1E3:
+                    best = detector
+            except Exception as e:
+                self.timings[backend] = None
+                print(f'{backend} unavailable: {e}')
+        print(f'Backend timings (ms/frame): {self.timings}')
+
+        cache[key] = self.timings
+        self.save_cache(cache)
+        return best if best is not None else make_detector(weights)
@@ -0,0 +1,470 @@
+import multiprocessing
+import os
+import json
+import queue
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from Detector import Detector
+from DetectionStore import DetectionReader, DetectionWriter
+from Tracker import Tracker, interpolate
+from utils.general import cv2
+
+
+# Read up to n frames from cap, fewer frames are returned at the end of the video
+def read_batch(cap, n):
+    frames = []
+    while len(frames) < n:
+        ret, frame = cap.read()
+        if not ret: break
+        frames.append(frame)
+    return frames
+
+
+# (width, height) of the frames of an opened video
+def frame_size(cap):
+    return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+
+# Detect one image file and write the annotated image at its original size and the detections to sidecar if given,
+# returns the detections
+def detect_image(detector, source, output, sidecar=None):
+    frame = cv2.imread(source)
+    if frame is None:
+        raise Exception(f'Image could not be read: {source}')
+    height, width = frame.shape[:2]
+    det = detector.predict(*detector.preprocess([frame], detector.input_buffer(1)))[0]
+    cv2.imwrite(output, detector.annotate(frame, det))
+    if sidecar:
+        detections = DetectionWriter(sidecar, 0, detector.names, width, height, source=source,
+                                     weights=str(detector.weights), settings=detector.settings())
+        detections.write(det)
+        detections.close()
+    return det
+
+
+# Write the annotated image of source from detections in original image coordinates, i.e. from the result cache
+def render_image(detector, source, output, det):
+    frame = cv2.imread(source)
+    if frame is None:
+        raise Exception(f'Image could not be read: {source}')
+    cv2.imwrite(output, detector.annotate(frame, torch.from_numpy(det)))
+
+
+# Annotate the next frames of cap with the detections of a DetectionReader and write them, the detections are copied
+# to a DetectionWriter if given and checkpointed every checkpoint_every frames, returns the number of frames written
+def render_frames(detector, cap, writer, reader, detections=None, progress=None, stop=None, total_frames=0,
+                  checkpoint_every=0):
+    frames_done = 0
+    while frames_done < len(reader) and not (stop and stop()):
+        ret, frame = cap.read()
+        if not ret: break
+        det = torch.from_numpy(reader.frame(frames_done))
+        writer.write(detector.annotate(frame, det))
+        if detections: detections.write(det, reader.timestamps[frames_done])
+        frames_done += 1
+        if detections and checkpoint_every and frames_done % checkpoint_every == 0: detections.checkpoint()
+        if progress and frames_done % 30 == 0: progress(frames_done, total_frames)
+    return frames_done
+
+
+# Write the annotated video of source from the detections of a DetectionReader without running the model,
+# returns the number of frames written
+def render_video(detector, source, output, reader, progress=None, stop=None):
+    cap = cv2.VideoCapture(source)
+    total_frames = min(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), len(reader))
+    writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'mp4v'), cap.get(cv2.CAP_PROP_FPS), frame_size(cap))
+    try:
+        return render_frames(detector, cap, writer, reader, progress=progress, stop=stop, total_frames=total_frames)
+    finally:
+        cap.release()
+        writer.release()
+
+
+# Frames of an interrupted run of detector on source that can be resumed from its sidecar, or from the .resume copy
+# left by a resume that was interrupted itself, 0 if there is none
+def resumable_frames(sidecar, source, detector):
+    return max(checkpointed_frames(sidecar, source, detector), checkpointed_frames(f'{sidecar}.resume', source, detector))
+
+
+def checkpointed_frames(sidecar, source, detector):
+    try:
+        reader = DetectionReader(sidecar)
+        meta = reader.meta
+        if meta['complete'] or meta.get('source') != source or meta.get('weights') != str(detector.weights):
+            return 0
+        if meta.get('settings') != json.loads(json.dumps(detector.settings())):
+            return 0
+        return len(reader)
+    except Exception:
+        return 0
+
+
+class MotionGate:
+
+    def __init__(self, threshold=0.0, max_skip=10, width=160) -> None:
+
+        self.threshold = threshold  # mean grey level difference (0-255) to the last inferred frame, 0 infers every frame
+        self.max_skip = max_skip  # frames in a row that reuse detections before inference is forced
+        self.width = width  # width of the compared grey thumbnails
+        self.reference = None  # thumbnail of the last inferred frame
+        self.run = 0  # frames in a row that reused detections
+        self.skipped = 0  # frames that reused detections
+
+    # True if frame needs inference, False if it is a near duplicate of the last inferred frame. Comparing with the
+    # last inferred frame instead of the previous one keeps a slow pan from drifting away from its detections
+    def check(self, frame):
+        if self.threshold <= 0:
+            return True
+        h, w = frame.shape[:2]
+        thumb = cv2.resize(frame, (self.width, max(1, round(self.width * h / w))), interpolation=cv2.INTER_AREA)
+        thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        if self.reference is not None and self.run < self.max_skip and \
+                cv2.absdiff(thumb, self.reference).mean() < self.threshold:
+            self.run += 1
+            self.skipped += 1
+            return False
+        self.reference = thumb
+        self.run = 0
+        return True
+
+    # Split a batch of frames into the frames that need inference, only keyframes are checked if keys are given,
+    # returns (inference flag per frame, frames to infer)
+    def split(self, frames, keys=None):
+        flags = [(keys is None or key) and self.check(f) for key, f in zip(keys or frames, frames)]
+        return flags, [f for f, infer in zip(frames, flags) if infer]
+
+
+class VideoDetectionPipeline:
+
+    def __init__(self, detector, source, output, batch_size=4, queue_size=4, progress=None, stop=None,
+                 sidecar=None, resume=False, checkpoint_every=300) -> None:
+
+        self.detector = detector
+        self.source = source
+        self.output = output
+        self.sidecar = sidecar  # folder for the per-frame detections in original frame coordinates, None to skip
+        self.resume = resume  # continue the interrupted run checkpointed in the sidecar, see resumable_frames()
+        self.checkpoint_every = checkpoint_every  # frames between sidecar checkpoints
+        self.batch_size = 1 if detector.tile else max(1, int(batch_size))  # a tiled frame is a batch of its own
+
+        # Bounded queues between the stages, a full queue blocks the stage before it (backpressure)
+        self.decoded = queue.Queue(maxsize=queue_size)  # batches waiting for inference
+        self.detected = queue.Queue(maxsize=queue_size)  # batches waiting for annotation and encoding
+        self.buffers = queue.Queue()  # preallocated input tensors, one per batch in flight between decode and inference
+        for _ in range(2 if detector.tile else queue_size + 2):  # tiled inputs hold every tile of a 4K frame
+            self.buffers.put(detector.input_buffer(self.batch_size))
+
+        self.gate = MotionGate(detector.motion_threshold, detector.motion_max_skip)  # reuses detections on still frames
+        self.last = torch.zeros((0, 6))  # detections of the last inferred frame
+
+        # Tracking, detection runs on every stride-th frame (keyframe) and the frames between wait in pending until
+        # the next keyframe so their boxes can be interpolated
+        self.tracker = Tracker() if detector.track else None
+        self.stride = detector.track_stride if detector.track else 1
+        self.pending = []  # frames since the last keyframe
+        self.last_key = torch.zeros((0, 7 if self.tracker else 6))  # detections of the last keyframe
+        self.counts = {}  # unique tracked objects per class name, set at the end of run()
+
+        self.progress = progress  # progress(frames_done, total_frames) callback
+        self.stop = stop or (lambda: False)  # returns True to cancel the run
+        self.frames_done = 0
+        self.total_frames = 0
+        self.skipped = 0  # frames that reused detections, set at the end of run()
+        self.error = None
+
+    def cancelled(self):
+        return self.error is not None or self.stop()
+
+    # Stage 1 (decode thread): read and preprocess frames into batches
+    def decode(self, cap):
+        try:
+            decoded = 0
+            while not self.cancelled():
+                frames = read_batch(cap, self.batch_size)
+                if not frames: break
+
+                keys = [(decoded + i) % self.stride == 0 for i in range(len(frames))]
+                decoded += len(frames)
+                flags, inferred = self.gate.split(frames, keys)
+                buffer, im, layout = None, None, None
+                if inferred:
+                    buffer = self.buffers.get()  # blocks until inference has released an input
+                    im, layout = self.detector.preprocess(inferred, buffer)
+                self.decoded.put((frames, keys, flags, im, layout, buffer))
+                if len(frames) < self.batch_size: break  # end of readable frames
+        except Exception as e:
+            self.error = e
+        finally:
+            self.decoded.put(None)  # end of stream
+
+    # Stage 2 (calling thread): batched inference and NMS, always drains the decode queue to the end of stream
+    def infer(self):
+        try:
+            while True:
+                item = self.decoded.get()
+                if item is None: break
+
+                frames, keys, flags, im, layout, buffer = item
+                try:
+                    if self.cancelled(): continue
+                    dets = self.detector.predict(im, layout) if buffer is not None else []
+                    self.detected.put((frames, keys, flags, dets))
+                finally:
+                    if buffer is not None: self.buffers.put(buffer)  # the input can be refilled
+        except Exception as e:
+            self.error = e
+            item = self.decoded.get()
+            while item is not None:
+                if item[5] is not None: self.buffers.put(item[5])
+                item = self.decoded.get()
+        finally:
+            self.detected.put(None)  # end of stream
+
+    # Stage 3 (encode thread): annotate and write the original frames in order, frames skipped by the motion gate get
+    # the detections of the last inferred frame, always drains the detection queue
+    def encode(self, writer, detections=None):
+        try:
+            while True:
+                item = self.detected.get()
+                if item is None: break
+                if self.cancelled(): continue
+
+                frames, keys, flags, dets = item
+                dets = iter(dets)
+                for frame, key, inferred in zip(frames, keys, flags):
+                    if inferred: self.last = next(dets)
+                    if key:
+                        self.keyframe(frame, writer, detections)
+                    else:
+                        self.pending.append(frame)
+                if detections and detections.frames - detections.meta['frames'] >= self.checkpoint_every:
+                    if self.tracker: detections.meta.update(self.track_meta())
+                    detections.checkpoint()
+                if self.progress: self.progress(self.frames_done, self.total_frames)
+
+            # Frames after the last keyframe keep its boxes
+            if not self.cancelled():
+                for frame in self.pending:
+                    self.write(frame, self.last_key, writer, detections)
+            self.pending = []
+        except Exception as e:
+            self.error = e
+            while self.detected.get() is not None: pass
+
+    # Track the detections of a keyframe, write the frames waiting for it with boxes interpolated between the last
+    # keyframe and this one, then the keyframe
+    def keyframe(self, frame, writer, detections):
+        det = self.last
+        steps = len(self.pending) + 1
+        if self.tracker:
+            det = torch.from_numpy(self.tracker.update(det.cpu().numpy(), steps))
+        for i, pending in enumerate(self.pending, 1):
+            self.write(pending, torch.from_numpy(interpolate(self.last_key.numpy(), det.numpy(), i / steps)), writer,
+                       detections)
+        self.pending = []
+        self.last_key = det
+        self.write(frame, det, writer, detections)
+
+    def write(self, frame, det, writer, detections):
+        writer.write(self.detector.annotate(frame, det))
+        if detections: detections.write(det)
+        self.frames_done += 1
+
+    # Unique object counts per class name and the next track ID, kept in the sidecar meta.json for a resumed run
+    def track_meta(self):
+        counts = {self.detector.names[c]: n for c, n in sorted(self.tracker.counts.items())}
+        return dict(counts=counts, next_track_id=self.tracker.next_id)
+
+    # Run the three stages over the whole video, returns the number of frames written
+    def run(self):
+        cap = cv2.VideoCapture(self.source)
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        writer = cv2.VideoWriter(self.output, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_size(cap))
+        detections, previous, finished = None, None, False
+        try:
+            if self.sidecar:
+                if self.resume and resumable_frames(self.sidecar, self.source, self.detector):
+                    previous = f'{self.sidecar}.resume'
+                    if checkpointed_frames(previous, self.source, self.detector) >= \
+                            checkpointed_frames(self.sidecar, self.source, self.detector):
+                        shutil.rmtree(self.sidecar, ignore_errors=True)  # an interrupted redraw of .resume
+                    else:
+                        shutil.rmtree(previous, ignore_errors=True)
+                        os.replace(self.sidecar, previous)  # the new sidecar is written from the first frame again
+                detections = DetectionWriter(self.sidecar, fps, self.detector.names, *frame_size(cap),
+                                             source=self.source, weights=str(self.detector.weights),
+                                             settings=self.detector.settings())
+
+            # Redraw the checkpointed frames from their detections, inference continues after them. The new sidecar
+            # checkpoints along the way and .resume is kept until the new sidecar has checkpointed past it
+            if previous:
+                reader = DetectionReader(previous)
+                self.frames_done = render_frames(self.detector, cap, writer, reader, detections, self.progress,
+                                                 self.stop, self.total_frames, self.checkpoint_every)
+                if self.tracker:
+                    # IDs and counts continue, objects visible across the interruption are counted again
+                    index = {self.detector.names[c]: c for c in range(len(self.detector.names))}
+                    counts = {index[name]: n for name, n in reader.meta.get('counts', {}).items() if name in index}
+                    self.tracker.resume(counts, reader.meta.get('next_track_id', 0))
+                    detections.meta.update(self.track_meta())
+                detections.checkpoint()
+                if self.frames_done >= len(reader):
+                    shutil.rmtree(previous, ignore_errors=True)
+                print(f'Resumed {self.source} after {self.frames_done} checkpointed frames')
+
+            decoder = threading.Thread(target=self.decode, args=(cap,), daemon=True)
+            encoder = threading.Thread(target=self.encode, args=(writer, detections), daemon=True)
+            decoder.start()
+            encoder.start()
+            self.infer()
+            decoder.join()
+            encoder.join()
+            finished = True
+        finally:
+            cap.release()
+            writer.release()
+            if self.tracker:
+                meta = self.track_meta()
+                self.counts = meta['counts']
+                if detections: detections.meta.update(meta)
+            if detections:
+                complete = finished and self.error is None and not self.stop()
+                detections.close(complete=complete)
+                if complete: shutil.rmtree(f'{self.sidecar}.resume', ignore_errors=True)
+
+        self.skipped = self.gate.skipped
+        if self.error is not None:
+            raise self.error
+        return self.frames_done
+
+
+# Worker process state, set once per process by _init_shard_worker
+_shard_detector = None  # Detector loaded once per worker process
+_shard_progress = None  # queue of (shard, frames_done) updates for the parent process
+_shard_stop = None  # event set by the parent process to cancel the run
+
+
+def _init_shard_worker(config, progress, stop, threads):
+    global _shard_detector, _shard_progress, _shard_stop
+    torch.set_num_threads(threads)  # share the cores between the workers
+    _shard_detector = Detector(**config)
+    _shard_detector.warmup()
+    _shard_progress, _shard_stop = progress, stop
+
+
+# Detect frames [start, end) of source into the sidecar folder, the output video is rendered once from the sidecars
+# by the parent process. Returns the number of frames detected and of frames that reused detections
+def _detect_shard(shard, source, sidecar, start, end, batch_size):
+    detector = _shard_detector
+    cap = cv2.VideoCapture(source)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    detections = DetectionWriter(sidecar, fps, detector.names)
+    buffer = detector.input_buffer(batch_size)
+    gate = MotionGate(detector.motion_threshold, detector.motion_max_skip)
+    det = torch.zeros((0, 6))
+    frames_done = 0
+    try:
+        while start + frames_done < end and not _shard_stop.is_set():
+            n = min(batch_size, end - start - frames_done)
+            frames = read_batch(cap, n)
+            if not frames: break
+
+            flags, inferred = gate.split(frames)
+            dets = iter(detector.predict(*detector.preprocess(inferred, buffer)) if inferred else [])
+            for i, infer in enumerate(flags):
+                if infer: det = next(dets)
+                detections.write(det, (start + frames_done + i) / (fps or 30))
+            frames_done += len(frames)
+            _shard_progress.put((shard, frames_done))
+            if len(frames) < n: break  # end of readable frames
+    finally:
+        cap.release()
+        detections.close()
+    return frames_done, gate.skipped
+
+
+class ShardedVideoDetection:
+
+    def __init__(self, detector, source, output, workers=2, batch_size=4, progress=None, stop=None,
+                 sidecar=None) -> None:
+
+        self.detector = detector
+        self.source = source
+        self.output = output
+        self.sidecar = sidecar  # folder for the per-frame detections in original frame coordinates, None to skip
+        self.workers = max(1, int(workers))
+        self.batch_size = 1 if detector.tile else max(1, int(batch_size))  # a tiled frame is a batch of its own
+        self.progress = progress  # progress(frames_done per shard, frames per shard) callback
+        self.stop = stop or (lambda: False)  # returns True to cancel the run
+        self.skipped = 0  # frames that reused detections, set at the end of run()
+
+    # Detect one frame range per worker process into its own sidecar, then render the output once from the sidecars
+    # in frame order, returns the number of frames written
+    def run(self):
+        cap = cv2.VideoCapture(self.source)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        n = max(1, min(self.workers, total_frames))
+        bounds = [total_frames * i // n for i in range(n + 1)]
+        sizes = [bounds[i + 1] - bounds[i] for i in range(n)]
+        sidecars = [f'{os.path.splitext(self.output)[0]}.part{i}.det' for i in range(n)]
+        frames_done = [0] * n
+
+        ctx = multiprocessing.get_context('spawn')
+        progress, stop = ctx.Queue(), ctx.Event()
+        threads = max(1, (os.cpu_count() or 1) // n)
+        try:
+            with ProcessPoolExecutor(n, mp_context=ctx, initializer=_init_shard_worker,
+                                     initargs=(self.detector.config(), progress, stop, threads)) as pool:
+                futures = [pool.submit(_detect_shard, i, self.source, sidecars[i], bounds[i], bounds[i + 1],
+                                       self.batch_size) for i in range(n)]
+
+                # Forward per-shard progress to the caller until every shard is finished
+                while not all(f.done() for f in futures):
+                    if self.stop(): stop.set()
+                    try:
+                        shard, done = progress.get(timeout=0.2)
+                        frames_done[shard] = done
+                        if self.progress: self.progress(frames_done, sizes)
+                    except queue.Empty:
+                        pass
+                self.skipped = sum(f.result()[1] for f in futures)  # raises the first worker error
+
+            return self.render(sizes, sidecars)
+        finally:
+            for sidecar in sidecars:
+                if os.path.exists(sidecar): shutil.rmtree(sidecar)
+
+    # Annotate the video once with the detections of the shards in frame order, a single encode of every frame.
+    # Stops after the first incomplete shard so a cancelled run still leaves a gapless video
+    def render(self, sizes, sidecars):
+        cap = cv2.VideoCapture(self.source)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        width, height = frame_size(cap)
+        writer = cv2.VideoWriter(self.output, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        detections = None
+        if self.sidecar:
+            detections = DetectionWriter(self.sidecar, fps, self.detector.names, width, height, source=self.source,
+                                         weights=str(self.detector.weights), settings=self.detector.settings())
+        rendered = [0] * len(sizes)  # the progress of the render pass restarts from the first shard
+
+        def progress(shard):
+            return lambda done, _: self.progress(rendered[:shard] + [done] + rendered[shard + 1:], sizes)
+
+        try:
+            for i, (size, sidecar) in enumerate(zip(sizes, sidecars)):
+                rendered[i] = render_frames(self.detector, cap, writer, DetectionReader(sidecar), detections,
+                                            progress(i) if self.progress else None, self.stop)
+                if rendered[i] < size: break
+        finally:
+            cap.release()
+            writer.release()
+            if detections: detections.close(complete=sum(rendered) == sum(sizes))
+        return sum(rendered)
@@ -0,0 +1,143 @@
+import json
+import os
+
+import numpy as np
+
+# Column: (dtype, values per row), one raw little-endian file per column
+COLUMNS = {'frame': ('<i4', 1), 'class': ('<i2', 1), 'conf': ('<f4', 1), 'xyxy': ('<f4', 4), 'track': ('<i4', 1)}
+
+
+# Sidecar folder of the detections of an annotated video, i.e. site_1_video_detection.mp4 -> site_1_video_detection.det
+def sidecar_path(output):
+    return f'{os.path.splitext(output)[0]}.det'
+
+
+class DetectionWriter:
+
+    def __init__(self, path, fps, names, width=0, height=0, **meta) -> None:
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.fps = fps or 30
+        self.files = {c: open(os.path.join(path, f'{c}.bin'), 'wb') for c in COLUMNS}
+        self.index = open(os.path.join(path, 'index.bin'), 'wb')  # first row of every frame (int64)
+        self.timestamps = open(os.path.join(path, 'timestamp.bin'), 'wb')  # seconds of every frame (float64)
+        self.rows = 0
+        self.frames = 0
+        self.meta = dict(meta, fps=self.fps, width=width, height=height, names=names, frames=0, rows=0, complete=False)
+        self.save_meta()
+
+    def save_meta(self):
+        f = os.path.join(self.path, 'meta.json')
+        with open(f'{f}.tmp', 'w') as file:
+            json.dump(self.meta, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f'{f}.tmp', f)  # a crash never leaves a half written meta.json
+
+    # Append the detections (n, 6) xyxy, conf, cls or (n, 7) with track IDs of the next frame, boxes in original frame
+    # coordinates
+    def write(self, det, timestamp=None):
+        det = det.cpu().numpy() if hasattr(det, 'cpu') else np.asarray(det)
+        n = len(det)
+        self.index.write(np.int64(self.rows).tobytes())
+        self.timestamps.write(np.float64(self.frames / self.fps if timestamp is None else timestamp).tobytes())
+        if n:
+            self.files['frame'].write(np.full(n, self.frames, dtype=COLUMNS['frame'][0]).tobytes())
+            self.files['class'].write(det[:, 5].astype(COLUMNS['class'][0]).tobytes())
+            self.files['conf'].write(det[:, 4].astype(COLUMNS['conf'][0]).tobytes())
+            self.files['xyxy'].write(det[:, :4].astype(COLUMNS['xyxy'][0]).tobytes())
+            track = det[:, 6] if det.shape[1] > 6 else np.full(n, -1)  # -1 for untracked detections
+            self.files['track'].write(track.astype(COLUMNS['track'][0]).tobytes())
+        self.rows += n
+        self.frames += 1
+
+    def flush(self):
+        for f in (*self.files.values(), self.index, self.timestamps):
+            f.flush()
+
+    # Flush the frames written so far to the disk itself, not only the OS cache, so they survive a power cut
+    def sync(self):
+        self.flush()
+        for f in (*self.files.values(), self.index, self.timestamps):
+            os.fsync(f.fileno())
+
+    # Sync the frames written so far and only then record them in meta.json, an interrupted run can resume after them
+    def checkpoint(self):
+        self.sync()
+        self.meta.update(frames=self.frames, rows=self.rows)
+        self.save_meta()
+
+    def close(self, complete=True):
+        self.sync()
+        for f in (*self.files.values(), self.index, self.timestamps):
+            f.close()
+        self.meta.update(frames=self.frames, rows=self.rows, complete=complete)
+        self.save_meta()
+
+
+class DetectionReader:
+
+    def __init__(self, path) -> None:
+
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        # Sidecars written before tracking have no track column
+        self.columns = {c: self.column(c) for c in COLUMNS if os.path.exists(os.path.join(path, f'{c}.bin'))}
+        self.rows = min(len(x) for x in self.columns.values())  # complete rows on disk, also for an interrupted run
+        self.timestamps = np.fromfile(os.path.join(path, 'timestamp.bin'), dtype='<f8')
+        # Frames up to the last checkpoint, the last one ends at the rows recorded with it. Without its index entry
+        # the end of the last indexed frame is unknown and that frame is dropped
+        index = np.fromfile(os.path.join(path, 'index.bin'), dtype='<i8')
+        n = self.meta['frames']
+        bounds = np.append(index[:n], self.meta['rows']) if len(index) >= n else index
+        self.index, self.ends = bounds[:-1], bounds[1:]  # first and last row + 1 of every frame
+        # Frames whose rows are all on disk, a frame is never returned with some of its boxes missing
+        self.frames = min(int(np.searchsorted(self.ends, self.rows, side='right')), len(self.timestamps))
+        self.index, self.ends = self.index[:self.frames], self.ends[:self.frames]
+
+    # Memory mapped column, rows are only read from disk when they are accessed
+    def column(self, name):
+        dtype, width = COLUMNS[name]
+        f = os.path.join(self.path, f'{name}.bin')
+        rows = os.path.getsize(f) // (np.dtype(dtype).itemsize * width)
+        if not rows:
+            return np.empty((0, width) if width > 1 else 0, dtype=dtype)
+        return np.memmap(f, dtype=dtype, mode='r', shape=(rows, width) if width > 1 else (rows,))
+
+    def __len__(self):
+        return self.frames
+
+    # Track IDs of rows [a, b), -1 for untracked detections
+    def tracks(self, a, b):
+        return np.asarray(self.columns['track'][a:b]) if 'track' in self.columns else np.full(b - a, -1)
+
+    # Detections (n, 7) xyxy, conf, cls, track of frame i, read without scanning the other frames
+    def frame(self, i):
+        a, b = self.index[i], self.ends[i]
+        det = np.zeros((b - a, 7), dtype=np.float32)
+        det[:, :4] = self.columns['xyxy'][a:b]
+        det[:, 4] = self.columns['conf'][a:b]
+        det[:, 5] = self.columns['class'][a:b]
+        det[:, 6] = self.tracks(a, b)
+        return det
+
+    # Rows of frames [start, end) as a pandas DataFrame with frame, timestamp, class, conf, x1, y1, x2, y2, track columns
+    def dataframe(self, start=0, end=None):
+        import pandas as pd
+
+        end = self.frames if end is None else min(end, self.frames)
+        if start >= end:
+            a = b = 0
+        else:
+            a, b = self.index[start], self.ends[end - 1]
+        frame = np.asarray(self.columns['frame'][a:b])
+        xyxy = np.asarray(self.columns['xyxy'][a:b]).reshape(-1, 4)
+        return pd.DataFrame({
+            'frame': frame,
+            'timestamp': self.timestamps[frame],
+            'class': np.asarray(self.columns['class'][a:b]),
+            'conf': np.asarray(self.columns['conf'][a:b]),
+            'x1': xyxy[:, 0], 'y1': xyxy[:, 1], 'x2': xyxy[:, 2], 'y2': xyxy[:, 3],
+            'track': self.tracks(a, b)})
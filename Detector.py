@@ -0,0 +1,315 @@
+import threading
+import time
+
+import numpy as np
+import torch
+
+from models.common import DetectMultiBackend
+from utils.general import (check_img_size, cv2, non_max_suppression, scale_boxes)
+from utils.plots import Annotator, colors
+from utils.torch_utils import select_device
+
+
+# Start positions of tiles of size n along a side of length, evenly spread with at least overlap (fraction) between
+# neighbours and the last tile ending on the edge
+def tile_starts(length, n, overlap):
+    if length <= n:
+        return [0]
+    step = max(1, int(n * (1 - overlap)))
+    count = int(np.ceil((length - n) / step)) + 1
+    return np.linspace(0, length - n, count).round().astype(int).tolist()
+
+
+# Greedy NMS of the merged tile detections (n, 6) on intersection over the smaller box, overlapping boxes are merged
+# into the highest confidence one with the largest box, so a box cut at a tile border gives way to the whole box found
+# in the overlapping tile or the full frame
+def cross_tile_nms(det, iou_thres=0.45, agnostic=False, max_det=1000):
+    if len(det) < 2:
+        return det
+    det = det[det[:, 4].argsort(descending=True)]
+    offset = 0 if agnostic else det[:, 5:6] * (det[:, :4].max() + 1)  # boxes of different classes never overlap
+    boxes = det[:, :4] + offset
+    inter = (torch.min(boxes[:, None, 2:], boxes[:, 2:]) - torch.max(boxes[:, None, :2], boxes[:, :2])).clamp(0).prod(2)
+    area = (boxes[:, 2:] - boxes[:, :2]).prod(1)
+    ios = inter / torch.min(area[:, None], area[None]).clamp(min=1E-6)
+    keep = torch.ones(len(det), dtype=torch.bool, device=det.device)
+    for i in range(len(det)):
+        if keep[i]:
+            group = torch.nonzero(keep[i + 1:] & (ios[i, i + 1:] > iou_thres))[:, 0] + i + 1
+            if len(group):
+                # The highest confidence takes the largest box of its group, a box cut at a tile border is the smaller
+                keep[group] = False
+                group = torch.cat((group.new_tensor([i]), group))
+                det[i, :4] = det[group[area[group].argmax()], :4]
+    return det[keep][:max_det]
+
+
+class Detector:
+
+    def __init__(self, weights, device='cpu', data=None, imgsz=(416, 416), conf_thres=0.25, iou_thres=0.45,
+                 max_det=1000, classes=None, agnostic_nms=False, augment=False, visualize=False,
+                 line_thickness=1, hide_labels=False, hide_conf=False, half=False, dnn=False, tile=False,
+                 tile_overlap=0.2, tile_min_std=0.0, tile_full_frame=True, tile_batch=8, motion_threshold=0.0,
+                 motion_max_skip=10, track=False, track_stride=1) -> None:
+
+        self.weights = weights
+        self.data = data
+        self.half = half
+        self.dnn = dnn
+        self.device = select_device(device) if isinstance(device, str) else device
+        self.model = DetectMultiBackend(weights, device=self.device, dnn=dnn, data=data, fp16=half)
+        self.stride, self.names, self.pt = self.model.stride, self.model.names, self.model.pt
+        self.backend = self.backend_name()
+        self.max_batch = self.backend_batch()  # None for any batch size
+        self.nms = self.backend_nms()  # NMS runs inside the exported model
+        self.imgsz = check_img_size(self.backend_imgsz() or imgsz, s=self.stride)  # check image size
+        self.warmed = False  # warmup runs once per loaded model
+        self.scratch = threading.local()  # resized uint8 frame reused by preprocess(), one per calling thread
+        self.latency = None  # measured seconds per frame, see benchmark()
+
+        # Inference settings
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.max_det = max_det
+        self.classes = classes
+        self.agnostic_nms = agnostic_nms
+        self.augment = augment
+        self.visualize = visualize
+
+        # Tiled inference settings, frames are cut into overlapping imgsz tiles at native resolution
+        self.tile = tile
+        self.tile_overlap = tile_overlap  # minimum overlap between neighbouring tiles (fraction of the tile size)
+        self.tile_min_std = tile_min_std  # tiles with a lower grey level standard deviation are skipped, 0 runs all
+        self.tile_full_frame = tile_full_frame  # also detect on the whole letterboxed frame, for objects over a tile
+        self.tile_batch = tile_batch  # tiles per forward pass, bounds the activation memory of a 4K frame
+        self.tile_counts = {'run': 0, 'skipped': 0}  # tiles detected and skipped as low texture
+
+        # Motion gate of video detection, see DetectionPipeline.MotionGate
+        self.motion_threshold = motion_threshold  # mean grey level change below which a frame reuses the last detections
+        self.motion_max_skip = motion_max_skip  # frames in a row that reuse detections before inference is forced
+
+        # Tracking of video detection, see Tracker.py
+        self.track = track  # give every object a track ID and count the unique objects per class
+        self.track_stride = max(1, int(track_stride))  # detect every track_stride frames, boxes are interpolated between
+
+        # Annotation settings
+        self.line_thickness = line_thickness
+        self.hide_labels = hide_labels
+        self.hide_conf = hide_conf
+
+    # Constructor arguments that build the same detector again, i.e. in a worker process
+    def config(self):
+        device = 'cpu' if self.device.type == 'cpu' else str(self.device.index or 0)
+        return dict(weights=self.weights, device=device, data=self.data, imgsz=self.imgsz,
+                    conf_thres=self.conf_thres, iou_thres=self.iou_thres, max_det=self.max_det, classes=self.classes,
+                    agnostic_nms=self.agnostic_nms, augment=self.augment, visualize=self.visualize,
+                    line_thickness=self.line_thickness, hide_labels=self.hide_labels, hide_conf=self.hide_conf,
+                    half=self.half, dnn=self.dnn, tile=self.tile, tile_overlap=self.tile_overlap,
+                    tile_min_std=self.tile_min_std, tile_full_frame=self.tile_full_frame, tile_batch=self.tile_batch,
+                    motion_threshold=self.motion_threshold, motion_max_skip=self.motion_max_skip, track=self.track,
+                    track_stride=self.track_stride)
+
+    # Settings that change the detections, results are only reused or resumed when these match
+    def settings(self):
+        settings = dict(imgsz=list(self.imgsz), resize='letterbox', conf_thres=self.conf_thres,
+                        iou_thres=self.iou_thres, max_det=self.max_det, classes=self.classes,
+                        agnostic_nms=self.agnostic_nms, augment=self.augment)
+        if self.tile:
+            settings.update(tile_overlap=self.tile_overlap, tile_min_std=self.tile_min_std,
+                            tile_full_frame=self.tile_full_frame, tile_merge='largest')
+        if self.motion_threshold > 0:
+            settings.update(motion_threshold=self.motion_threshold, motion_max_skip=self.motion_max_skip)
+        if self.track:
+            settings.update(track=True, track_stride=self.track_stride)
+        return settings
+
+    def backend_name(self):
+        m = self.model
+        if m.onnx and m.dnn:
+            return 'OpenCV DNN'
+        for flag, name in (('pt', 'PyTorch'), ('jit', 'TorchScript'), ('onnx', 'ONNX Runtime'), ('xml', 'OpenVINO'),
+                           ('engine', 'TensorRT')):
+            if getattr(m, flag, False):
+                return name
+        return 'Other'
+
+    # Largest batch the backend accepts, exported models have a fixed batch size unless exported with --dynamic
+    def backend_batch(self):
+        if self.pt:
+            return None
+        if self.backend == 'ONNX Runtime':
+            b = self.model.session.get_inputs()[0].shape[0]
+            return None if isinstance(b, str) else int(b)
+        return 1
+
+    # True for ONNX models exported with NMS in the graph (export.py --include onnx --nms)
+    def backend_nms(self):
+        if self.backend == 'ONNX Runtime':
+            return self.model.session.get_modelmeta().custom_metadata_map.get('nms') == 'True'
+        return False
+
+    # Fixed (height, width) input of an exported ONNX model, None if the model takes the configured size
+    def backend_imgsz(self):
+        if self.backend == 'ONNX Runtime':
+            h, w = self.model.session.get_inputs()[0].shape[2:]
+            if isinstance(h, int) and isinstance(w, int):
+                return [h, w]
+        return None
+
+    # Warm the model up on its first use, returns the time spent (0 if the model is already warm)
+    def warmup(self, bs=1):
+        if self.warmed:
+            return 0.0
+        t = time.time()
+        self.model.warmup(imgsz=(1 if self.pt else self.max_batch or bs, 3, *self.imgsz))
+        self.warmed = True
+        return time.time() - t
+
+    # Preallocated (batch, 3, h, w) model input, filled by preprocess() and reused for every batch
+    def input_buffer(self, batch=1):
+        return torch.zeros((batch, 3, *self.imgsz), dtype=torch.float16 if self.model.fp16 else torch.float32)
+
+    # Letterbox BGR frames to the inference size (or cut them into tiles in tiled mode) and write them into buffer as
+    # RGB CHW 0.0 - 1.0, one pass per image without intermediate arrays. Returns the (n, 3, h, w) input view of buffer
+    # and the layout predict() maps the detections back to the frames with: (frame shape, full frame, tile origins)
+    def preprocess(self, frames, buffer):
+        if self.tile:
+            return self.preprocess_tiles(frames, buffer)
+        out = buffer.numpy()
+        for i, frame in enumerate(frames):
+            self.fill_letterbox(out[i], frame)
+        return buffer[:len(frames)], [(frame.shape, True, []) for frame in frames]
+
+    # Write a BGR HWC uint8 image into a CHW input slot at (top, left), the rest of the slot is letterbox grey
+    def fill(self, slot, im, top=0, left=0):
+        h, w = im.shape[:2]
+        if (h, w) != tuple(slot.shape[1:]):
+            slot.fill(114 / 255)
+        chw = im.transpose(2, 0, 1)[::-1]  # HWC to CHW, BGR to RGB (strided view, no copy)
+        np.multiply(chw, 1 / 255, out=slot[:, top:top + h, left:left + w], dtype=slot.dtype, casting='unsafe')
+
+    # Letterbox a BGR frame into a CHW input slot like letterbox(auto=False): resized with its aspect ratio into a
+    # reused uint8 scratch image and centred, so scale_boxes() maps the boxes back
+    def fill_letterbox(self, slot, frame):
+        h, w = frame.shape[:2]
+        th, tw = self.imgsz
+        r = min(th / h, tw / w)
+        nh, nw = int(round(h * r)), int(round(w * r))
+        if (nh, nw) != (h, w):
+            scratch = getattr(self.scratch, 'im', None)
+            if scratch is None or scratch.shape != (nh, nw, 3):
+                scratch = self.scratch.im = np.empty((nh, nw, 3), dtype=np.uint8)
+            frame = cv2.resize(frame, (nw, nh), dst=scratch, interpolation=cv2.INTER_LINEAR)
+        self.fill(slot, frame, int(round((th - nh) / 2 - 0.1)), int(round((tw - nw) / 2 - 0.1)))
+
+    # Tiled preprocess: every frame becomes its imgsz tiles at native resolution (and the whole letterboxed frame),
+    # tiles with less texture than tile_min_std are left out, buffer grows to fit all images of the batch
+    def preprocess_tiles(self, frames, buffer):
+        th, tw = self.imgsz
+        layout, images = [], []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            xs, ys = tile_starts(width, tw, self.tile_overlap), tile_starts(height, th, self.tile_overlap)
+            tiles = [(x, y) for y in ys for x in xs]
+            if self.tile_min_std > 0:
+                # Texture of every tile from a quarter size grey copy of the frame
+                small = cv2.resize(frame, (max(1, width // 4), max(1, height // 4)), interpolation=cv2.INTER_AREA)
+                grey = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+                textured = [(x, y) for x, y in tiles
+                            if grey[y // 4:(y + th) // 4, x // 4:(x + tw) // 4].std() >= self.tile_min_std]
+                self.tile_counts['skipped'] += len(tiles) - len(textured)
+                tiles = textured
+            self.tile_counts['run'] += len(tiles)
+            layout.append((frame.shape, self.tile_full_frame, tiles))
+            if self.tile_full_frame:
+                images.append((frame, True))  # letterboxed by fill_letterbox()
+            images += [(frame[y:y + th, x:x + tw], False) for x, y in tiles]  # views, copied once by fill()
+
+        if len(buffer) < len(images):
+            buffer.resize_(len(images), 3, th, tw)  # grows in place, the buffer stays the same tensor
+        out = buffer.numpy()
+        for i, (im, full) in enumerate(images):
+            if full:
+                self.fill_letterbox(out[i], im)
+            else:
+                self.fill(out[i], im)
+        return buffer[:len(images)], layout
+
+    # Mean seconds per frame of inference on a blank frame, warms the model up first
+    def benchmark(self, n=5):
+        self.warmup()
+        im = self.input_buffer(1)
+        t = time.time()
+        for _ in range(n):
+            self.detect(im)
+        self.latency = (time.time() - t) / n
+        return self.latency
+
+    # Run one forward pass and NMS over a preprocessed (N, 3, h, w) input, returns the input shape and detections per image
+    def detect(self, im):
+        chunk = self.max_batch or (self.tile_batch if self.tile else None)
+        if chunk is not None and len(im) > chunk:
+            # Fixed batch backends and the tiles of a frame run in chunks
+            pred = []
+            for i in range(0, len(im), chunk):
+                shape, p = self.detect(im[i:i + chunk])
+                pred.extend(p)
+            return shape, pred
+
+        n = len(im)
+        if self.max_batch is not None and n < self.max_batch:
+            im = torch.cat((im, im[-1:].expand(self.max_batch - n, *im.shape[1:])))  # pad to the fixed batch size
+        im = im.to(self.device)
+
+        # Inference
+        pred = self.model(im, augment=self.augment, visualize=self.visualize)
+
+        # NMS
+        if self.nms:
+            pred = [pred]  # (n, 6) of the single image, thresholds were fixed at export
+            if self.classes is not None:
+                pred = [pred[0][(pred[0][:, 5:6] == torch.tensor(self.classes, device=pred[0].device)).any(1)]]
+        else:
+            pred = non_max_suppression(pred, self.conf_thres, self.iou_thres, self.classes, self.agnostic_nms, max_det=self.max_det)
+        return im.shape[2:], pred[:n]
+
+    # Run the model on an input from preprocess(), returns the detections (n, 6) of every frame in original frame
+    # coordinates, in tiled mode the tile detections are shifted to their tile origin and merged with cross-tile NMS
+    def predict(self, im, layout):
+        shape, pred = self.detect(im) if len(im) else (self.imgsz, [])
+        dets, i = [], 0
+        for im0_shape, full, tiles in layout:
+            det = [self.rescale(pred[i], shape, im0_shape)] if full else []
+            i += int(full)
+            for x, y in tiles:
+                d = pred[i].clone()
+                d[:, [0, 2]] += x
+                d[:, [1, 3]] += y
+                det.append(d)
+                i += 1
+            det = torch.cat(det) if det else torch.zeros((0, 6))
+            dets.append(cross_tile_nms(det, self.iou_thres, self.agnostic_nms, self.max_det) if tiles else det)
+        return dets
+
+    # Map boxes from the letterboxed inference shape to the original image of im0_shape, returns a new tensor
+    def rescale(self, det, shape, im0_shape):
+        det = det.clone()
+        det[:, :4] = scale_boxes(shape, det[:, :4], im0_shape).round()
+        return det
+
+    # Draw the detections of one image onto im0, boxes are rescaled from the inference shape to im0 size when shape is given
+    def annotate(self, im0, det, shape=None, bgr=True):
+        annotator = Annotator(im0, line_width=self.line_thickness, example=str(self.names))
+        if len(det):
+            if shape is not None:
+                det = self.rescale(det, shape, im0.shape)
+
+            # Write results
+            for d in reversed(det):
+                *xyxy, conf, cls = d[:6]
+                c = int(cls)  # integer class
+                label = None if self.hide_labels else (self.names[c] if self.hide_conf else f'{self.names[c]} {conf:.2f}')
+                if label is not None and len(d) > 6 and d[6] >= 0:
+                    label = f'#{int(d[6])} {label}'  # track ID
+                annotator.box_label(xyxy, label, color=colors(c, bgr))
+        return annotator.result()
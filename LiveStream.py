@@ -0,0 +1,215 @@
+import threading
+import time
+
+import numpy as np
+
+from utils.general import cv2
+
+
+class FPSCounter:
+
+    def __init__(self, window=1.0) -> None:
+
+        self.window = window  # seconds per measurement
+        self.fps = 0.0
+        self.count = 0
+        self.start = time.time()
+
+    def tick(self):
+        self.count += 1
+        elapsed = time.time() - self.start
+        if elapsed >= self.window:
+            self.fps = self.count / elapsed
+            self.count = 0
+            self.start = time.time()
+
+
+class ColourAdjuster:
+
+    def __init__(self) -> None:
+
+        self.values = None  # (brightness, contrast, saturation) the tables were built for
+        self.lut = None  # brightness/contrast table, same for every channel
+        self.hsv_lut = None  # saturation table, identity on H and V
+        self.buffers = {}  # preallocated frames reused across calls
+
+    # Rebuild the lookup tables only when a slider value changed
+    def update(self, brightness, contrast, saturation):
+        if self.values == (brightness, contrast, saturation):
+            return
+        x = np.arange(256, dtype=np.float64)
+        self.lut = np.clip(np.rint(np.abs(x * (contrast/255.0+1) + brightness)), 0, 255).astype(np.uint8)  # convertScaleAbs
+        identity = x.astype(np.uint8)
+        s = np.clip(x + saturation, 0, 255).astype(np.uint8)  # saturating add on S
+        self.hsv_lut = np.dstack((identity, s, identity))
+        self.values = (brightness, contrast, saturation)
+
+    def buffer(self, name, shape):
+        if name not in self.buffers or self.buffers[name].shape != shape:
+            self.buffers[name] = np.empty(shape, dtype=np.uint8)
+        return self.buffers[name]
+
+    # Apply the slider values to a BGR frame, returns an RGB frame in a buffer that is reused on the next call
+    def apply(self, frame, brightness, contrast, saturation):
+        self.update(brightness, contrast, saturation)
+        shape = frame.shape
+        adjusted = cv2.LUT(frame, self.lut, dst=self.buffer('adjusted', shape))
+        rgb = self.buffer('rgb', shape)
+        if saturation:
+            hsv = cv2.cvtColor(adjusted, cv2.COLOR_BGR2HSV, dst=self.buffer('hsv', shape))
+            cv2.LUT(hsv, self.hsv_lut, dst=hsv)
+            cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB, dst=rgb)
+        else:
+            cv2.cvtColor(adjusted, cv2.COLOR_BGR2RGB, dst=rgb)  # no saturation change, skip the HSV round trip
+        return cv2.GaussianBlur(rgb, (3,3), 0, dst=self.buffer('blurred', shape))
+
+
+class LiveStreamPipeline:
+
+    def __init__(self, camera, settings, display, display_size=None, record=None, error=None, detector=None) -> None:
+
+        self.camera = camera
+        self.settings = settings  # returns the (brightness, contrast, saturation) slider values
+        self.display = display  # display(frame) hands a processed RGB frame to the GUI thread
+        self.display_size = display_size  # returns the (width, height) displayed frames are scaled to
+        self.record = record  # record(frame) receives every processed RGB frame
+        self.error = error  # error(exception) is called once if the camera or processing fails
+        self.detector = detector  # Detector for the live overlay, None disables live detection
+
+        self.adjuster = ColourAdjuster()
+        self.latest = None  # newest (frame, capture time) not processed yet
+        self.detect_latest = None  # newest (frame, capture time) waiting for the detection thread
+        self.detections = None  # (detector, boxes in camera frame coordinates, camera frame shape) of the last detected frame
+        self.latency = 0.0  # seconds from capture to detection result of the last detected frame
+        self.detect_buffer = None  # (detector, preallocated input) of the detection thread
+        self.condition = threading.Condition()
+        self.display_pending = False  # the GUI thread has not painted the last frame handed to it
+        self.running = False
+        self.threads = []
+
+        self.fps = {'capture': FPSCounter(), 'processing': FPSCounter(), 'display': FPSCounter(), 'detection': FPSCounter()}
+        self.dropped = {'capture': 0, 'processing': 0, 'display': 0, 'detection': 0}
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self.grab, daemon=True), threading.Thread(target=self.process, daemon=True),
+                        threading.Thread(target=self.detect, daemon=True)]
+        for t in self.threads:
+            t.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for t in self.threads:
+            if t is not threading.current_thread():
+                t.join(timeout=1)
+
+    def fail(self, e):
+        if self.running:
+            self.stop()
+            if self.error: self.error(e)
+
+    # Capture thread: keep reading the camera and only keep the newest frame
+    def grab(self):
+        try:
+            while self.running:
+                ret, frame = self.camera.read()
+                if not ret: continue
+                with self.condition:
+                    if self.latest is not None:
+                        self.dropped['capture'] += 1  # replaced before it was processed
+                    self.latest = (frame, time.time())
+                    self.condition.notify_all()
+                self.fps['capture'].tick()
+        except Exception as e:
+            self.fail(e)
+
+    # Processing thread: adjust and record the newest frame, then hand it to the display if it is free
+    def process(self):
+        try:
+            while True:
+                with self.condition:
+                    while self.running and self.latest is None:
+                        self.condition.wait()
+                    if not self.running:
+                        return
+                    (frame, captured), self.latest = self.latest, None
+
+                    # Hand the raw frame to the detection thread, an older frame it has not started on is dropped
+                    if self.detector is not None:
+                        if self.detect_latest is not None:
+                            self.dropped['detection'] += 1
+                        self.detect_latest = (frame, captured)
+                        self.condition.notify_all()
+
+                frame = self.adjuster.apply(frame, *self.settings())  # reused buffer
+                if self.record: self.record(frame)
+                self.fps['processing'].tick()
+
+                if self.display_pending:
+                    self.dropped['processing'] += 1  # the GUI thread is still busy with the last frame
+                    continue
+                # The display gets its own copy, the adjusted frame buffer is overwritten by the next frame
+                if self.display_size:
+                    frame = cv2.resize(frame, self.display_size(), interpolation=cv2.INTER_AREA)
+                else:
+                    frame = frame.copy()
+
+                # Draw the latest detections over the newer frame
+                detections = self.detections
+                if detections is not None and detections[0] is self.detector:
+                    detector, det, camera_shape = detections
+                    det = det.clone()
+                    det[:, [0, 2]] *= frame.shape[1] / camera_shape[1]  # camera frame to display size
+                    det[:, [1, 3]] *= frame.shape[0] / camera_shape[0]
+                    frame = detector.annotate(frame, det, bgr=False)
+                self.display_pending = True
+                self.display(frame)
+        except Exception as e:
+            self.fail(e)
+
+    # Detection thread: run the model on the newest frame whenever it is free, so inference never delays the display
+    def detect(self):
+        try:
+            while True:
+                with self.condition:
+                    while self.running and (self.detector is None or self.detect_latest is None):
+                        self.condition.wait()
+                    if not self.running:
+                        return
+                    detector = self.detector
+                    (frame, captured), self.detect_latest = self.detect_latest, None
+
+                detector.warmup()
+                if self.detect_buffer is None or self.detect_buffer[0] is not detector:
+                    self.detect_buffer = (detector, detector.input_buffer(1))  # reused for every detected frame
+                det = detector.predict(*detector.preprocess([frame], self.detect_buffer[1]))[0]
+                self.detections = (detector, det, frame.shape)
+                self.latency = time.time() - captured
+                self.fps['detection'].tick()
+        except Exception as e:
+            self.fail(e)
+
+    # Turn live detection on with a Detector or off with None
+    def set_detector(self, detector):
+        with self.condition:
+            self.detector = detector
+            self.detect_latest = None
+            self.detections = None
+            self.condition.notify_all()
+
+    # Called by the GUI thread after a frame was painted (or discarded)
+    def displayed(self, painted=True):
+        if painted:
+            self.fps['display'].tick()
+        else:
+            self.dropped['display'] += 1
+        self.display_pending = False
+
+    def stats(self):
+        return ' | '.join(f'{stage.capitalize()}: {self.fps[stage].fps:.1f} FPS, {self.dropped[stage]} dropped'
+                          for stage in self.fps)
+
+    def detection_stats(self):
+        return f"Detection: {self.fps['detection'].fps:.1f} FPS, {self.latency * 1E3:.0f} ms latency"
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from BackendSelector import file_hash
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+class ResultCache:
+
+    def __init__(self, root, max_mb=2048) -> None:
+
+        self.root = root  # one <key>.det detections folder per cached run
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.hashes_file = os.path.join(root, 'hashes.json')  # file hashes by path, size and modification time
+        os.makedirs(root, exist_ok=True)
+        try:
+            with open(self.hashes_file) as f:
+                self.hashes = json.load(f)
+        except Exception:
+            self.hashes = {}
+
+    # Content hash of a file or a folder (OpenVINO models), recomputed only when the file changed
+    def content_hash(self, path):
+        path = os.path.abspath(path)
+        files = sorted(os.path.join(r, f) for r, _, fs in os.walk(path) for f in fs) if os.path.isdir(path) else [path]
+        h = hashlib.sha256()
+        for f in files:
+            stat = os.stat(f)
+            k = f'{f}|{stat.st_size}|{stat.st_mtime_ns}'
+            if k not in self.hashes:
+                self.hashes[k] = file_hash(f)
+            h.update(self.hashes[k].encode())
+        try:
+            with open(self.hashes_file, 'w') as f:
+                json.dump(self.hashes, f)
+        except Exception as e:
+            print(f'Result cache hashes not saved: {e}')
+        return h.hexdigest()
+
+    # Cache key of detecting media with detector, any change of media, weights or inference settings changes the key
+    def key(self, media, detector):
+        h = hashlib.sha256()
+        h.update(self.content_hash(media).encode())
+        h.update(self.content_hash(detector.weights).encode())
+        h.update(json.dumps(detector.settings(), sort_keys=True).encode())
+        return h.hexdigest()
+
+    # Path of the cached detections folder for key, None on a miss
+    def get(self, key):
+        path = os.path.join(self.root, f'{key}.det')
+        if not os.path.isdir(path):
+            return None
+        now = time.time()
+        os.utime(path, (now, now))  # most recently used
+        return path
+
+    # Copy a complete detections folder into the cache and evict the least recently used entries over the size limit
+    def put(self, key, sidecar):
+        path = os.path.join(self.root, f'{key}.det')
+        tmp = f'{path}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.copytree(sidecar, tmp)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        entries = [os.path.join(self.root, x) for x in os.listdir(self.root) if x.endswith('.det')]
+        entries = sorted((os.path.getmtime(x), dir_size(x), x) for x in entries)  # oldest first
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
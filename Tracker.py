@@ -0,0 +1,132 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# Constant velocity Kalman filter over [cx, cy, area, aspect, vx, vy, v_area] (SORT), one row per track
+H = np.eye(4, 7)  # measurement: the box without the velocities
+R = np.diag([1.0, 1.0, 10.0, 10.0])  # measurement noise
+Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])  # process noise per frame
+P0 = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])  # initial covariance, the velocities are unknown
+
+
+# xyxy boxes (n, 4) to Kalman measurements (n, 4) cx, cy, area, aspect
+def xyxy2z(boxes):
+    w, h = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+    return np.stack((boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w * h, w / np.maximum(h, 1E-6)), 1)
+
+
+# Kalman states (n, 7) to xyxy boxes (n, 4)
+def x2xyxy(x):
+    w = np.sqrt(np.maximum(x[:, 2] * x[:, 3], 0))
+    h = x[:, 2] / np.maximum(w, 1E-6)
+    return np.stack((x[:, 0] - w / 2, x[:, 1] - h / 2, x[:, 0] + w / 2, x[:, 1] + h / 2), 1)
+
+
+# IoU matrix (n, m) of xyxy boxes a (n, 4) and b (m, 4)
+def box_iou(a, b):
+    inter = (np.minimum(a[:, None, 2:], b[:, 2:]) - np.maximum(a[:, None, :2], b[:, :2])).clip(0).prod(2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(1)
+    return inter / np.maximum(area_a[:, None] + area_b - inter, 1E-6)
+
+
+# Detections (n, 7) of a frame t / n of the way from keyframe a to keyframe b: boxes of the tracks found in both are
+# interpolated linearly, tracks only in a (and untracked rows) keep their box, tracks that first appear in b are left out
+def interpolate(a, b, t):
+    det = a.copy()
+    tracked = det[:, 6] >= 0
+    if tracked.any() and len(b):
+        ids = b[:, 6]
+        match = (det[:, None, 6] == ids[None]) & tracked[:, None] & (ids[None] >= 0)
+        i, j = np.nonzero(match)
+        det[i, :4] += (b[j, :4] - det[i, :4]) * t
+    return det
+
+
+class Tracker:
+
+    def __init__(self, iou_thres=0.3, max_age=30, min_hits=3) -> None:
+
+        self.iou_thres = iou_thres  # minimum IoU between a predicted track box and a detection of the same class
+        self.max_age = max_age  # frames a track is kept without a matching detection
+        self.min_hits = min_hits  # matched detections before a track gets an ID and is counted
+        self.x = np.zeros((0, 7))  # Kalman states
+        self.p = np.zeros((0, 7, 7))  # Kalman covariances
+        self.cls = np.zeros(0, dtype=int)
+        self.hits = np.zeros(0, dtype=int)
+        self.age = np.zeros(0, dtype=int)  # frames since the last matching detection
+        self.ids = np.full(0, -1, dtype=int)  # -1 until the track is confirmed
+        self.next_id = 0
+        self.counts = {}  # confirmed tracks per class, i.e. unique objects seen
+
+    # Continue the IDs and counts of an interrupted run
+    def resume(self, counts, next_id):
+        self.counts = dict(counts)
+        self.next_id = next_id
+
+    # Advance all tracks by steps frames
+    def predict(self, steps=1):
+        f = np.eye(7)
+        f[[0, 1, 2], [4, 5, 6]] = steps
+        self.x[self.x[:, 2] + self.x[:, 6] * steps <= 0, 6] = 0  # the area never goes negative
+        self.x = self.x @ f.T
+        self.p = f @ self.p @ f.T + Q * steps
+
+    # Correct the tracks idx with their matched measurements z (m, 4)
+    def correct(self, idx, z):
+        p = self.p[idx]
+        s = H @ p @ H.T + R
+        k = p @ H.T @ np.linalg.inv(s)  # Kalman gains (m, 7, 4)
+        y = z - self.x[idx] @ H.T
+        self.x[idx] += (k @ y[..., None])[..., 0]
+        self.p[idx] = (np.eye(7) - k @ H) @ p
+
+    # Associate the detections (n, 6) xyxy, conf, cls of the next keyframe, steps frames after the last one, with the
+    # tracks. Returns the detections with a 7th column of track IDs, -1 for detections of unconfirmed tracks
+    def update(self, det, steps=1):
+        det = np.asarray(det, dtype=np.float32).reshape(-1, 6)
+        self.predict(steps)
+        self.age += steps
+
+        # Match on IoU with the predicted boxes, only within the same class
+        matched_tracks, matched_dets = np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        if len(self.x) and len(det):
+            iou = box_iou(x2xyxy(self.x), det[:, :4]) * (self.cls[:, None] == det[None, :, 5])
+            rows, cols = linear_sum_assignment(-iou)
+            keep = iou[rows, cols] >= self.iou_thres
+            matched_tracks, matched_dets = rows[keep], cols[keep]
+        z = xyxy2z(det[:, :4])
+        if len(matched_tracks):
+            self.correct(matched_tracks, z[matched_dets])
+            self.hits[matched_tracks] += 1
+            self.age[matched_tracks] = 0
+
+        # New tracks for the unmatched detections
+        new = np.setdiff1d(np.arange(len(det)), matched_dets)
+        if len(new):
+            x = np.zeros((len(new), 7))
+            x[:, :4] = z[new]
+            self.x = np.concatenate((self.x, x))
+            self.p = np.concatenate((self.p, np.repeat(P0[None], len(new), 0)))
+            self.cls = np.concatenate((self.cls, det[new, 5].astype(int)))
+            self.hits = np.concatenate((self.hits, np.ones(len(new), dtype=int)))
+            self.age = np.concatenate((self.age, np.zeros(len(new), dtype=int)))
+            self.ids = np.concatenate((self.ids, np.full(len(new), -1, dtype=int)))
+        track = np.zeros(len(det), dtype=int)  # track row of every detection
+        track[matched_dets] = matched_tracks
+        track[new] = np.arange(len(self.x) - len(new), len(self.x))
+
+        # Confirm tracks with enough hits, every confirmed track is one unique object
+        confirm = np.nonzero((self.ids < 0) & (self.hits >= self.min_hits))[0]
+        for i in confirm:
+            self.ids[i] = self.next_id
+            self.next_id += 1
+            c = int(self.cls[i])
+            self.counts[c] = self.counts.get(c, 0) + 1
+
+        out = np.concatenate((det, self.ids[track][:, None].astype(np.float32)), 1)
+
+        # Drop the tracks that have not been seen for too long
+        alive = self.age <= self.max_age
+        self.x, self.p, self.cls, self.hits, self.age, self.ids = \
+            self.x[alive], self.p[alive], self.cls[alive], self.hits[alive], self.age[alive], self.ids[alive]
+        return out
@@ -0,0 +1,172 @@
+import threading
+from collections import OrderedDict
+
+from utils.general import cv2
+
+
+# Scale a BGR frame to fit in width x height keeping its aspect ratio, returns an RGB frame
+def fit_frame(frame, width, height):
+    h, w = frame.shape[:2]
+    r = min(width / w, height / h)
+    size = (max(1, round(w * r)), max(1, round(h * r)))
+    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA if r < 1 else cv2.INTER_LINEAR)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+class FrameCache:
+
+    def __init__(self, max_mb=256) -> None:
+
+        self.frames = OrderedDict()  # frame index -> frame, least recently used first
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, index):
+        return index in self.frames
+
+    def get(self, index):
+        frame = self.frames.get(index)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.frames.move_to_end(index)
+        self.hits += 1
+        return frame
+
+    # Add a frame and evict the least recently used frames until the cache is under its memory limit
+    def put(self, index, frame):
+        if index in self.frames:
+            self.nbytes -= self.frames.pop(index).nbytes
+        self.frames[index] = frame
+        self.nbytes += frame.nbytes
+        while self.nbytes > self.max_bytes and len(self.frames) > 1:
+            _, old = self.frames.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def clear(self):
+        self.frames.clear()
+        self.nbytes = 0
+
+
+class FrameReader:
+
+    def __init__(self, source, max_skip=8, cache_mb=256) -> None:
+
+        self.cap = cv2.VideoCapture(source)
+        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
+        self.max_skip = max_skip  # forward jumps up to this many frames are decoded through instead of seeking
+        self.position = 0  # index of the frame the next cap.read() returns
+        self.seeks = 0  # number of seeks, for benchmarking
+        self.cache = FrameCache(cache_mb)  # display-scaled RGB frames
+        self.display_size = None  # (width, height) of the cached frames
+        self.lock = threading.RLock()  # the GUI thread and the prefetch thread share the decoder
+        self.cache_lock = threading.Lock()  # short lock of the cache, never held during a decode
+
+    # Return frame index (BGR) or None, decoding sequentially and only seeking on jumps
+    def read(self, index):
+        skip = index - self.position
+        if self.position < 0 or skip < 0 or skip > self.max_skip:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)  # keyframe seek plus decode forward
+            self.seeks += 1
+        else:
+            for _ in range(skip):
+                self.cap.grab()  # skipped frames are demuxed but never converted
+        self.position = index
+
+        ret, frame = self.cap.read()
+        if not ret:
+            self.position = -1  # unknown position, seek on the next read
+            return None
+        self.position = index + 1
+        return frame
+
+    # Return frame index scaled to fit width x height as RGB or None, served from the cache when possible.
+    # A cached frame never waits for the decoder, which the prefetch thread can hold for a whole 4K decode
+    def display_frame(self, index, width, height):
+        with self.cache_lock:
+            if (width, height) != self.display_size:
+                self.cache.clear()  # display resized, cached frames are stale
+                self.display_size = (width, height)
+            frame = self.cache.get(index)
+        if frame is not None:
+            return frame
+
+        with self.lock:
+            with self.cache_lock:  # decoded by the prefetch thread while waiting for the decoder
+                frame = self.cache.frames.get(index)
+            if frame is None:
+                frame = self.read(index)
+                if frame is None:
+                    return None
+                frame = fit_frame(frame, width, height)
+                with self.cache_lock:
+                    if (width, height) == self.display_size:  # not resized during the decode
+                        self.cache.put(index, frame)
+            return frame
+
+    # Release the decoder once the prefetch thread is out of it, stop() only waits a second for a slow decode
+    def release(self):
+        with self.lock:
+            self.cap.release()
+            with self.cache_lock:
+                self.cache.clear()
+
+
+class FramePrefetcher:
+
+    def __init__(self, reader, depth=16, max_depth=64) -> None:
+
+        self.reader = reader
+        self.base_depth = depth  # frames decoded ahead at normal playback speed
+        self.max_depth = max_depth
+        self.depth = depth
+        self.index = 0  # frame on display, the frames after it are prefetched
+        self.display_size = None  # (width, height) the frames are scaled to
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.prefetch, daemon=True)
+        self.thread.start()
+
+    # Adapt the prefetch depth to the playback speed ratio, faster playback needs more frames ready
+    def set_speed(self, ratio):
+        with self.condition:
+            self.depth = int(min(self.max_depth, max(2, round(self.base_depth * ratio))))
+            self.condition.notify()
+
+    # Move the prefetch window to the frames after the frame on display
+    def seek(self, index, width, height):
+        with self.condition:
+            self.index = index
+            self.display_size = (width, height)
+            self.condition.notify()
+
+    # First frame of the prefetch window that is not decoded yet, or None
+    def next_missing(self):
+        if self.display_size is None:
+            return None
+        for i in range(self.index + 1, min(self.index + 1 + self.depth, self.reader.total_frames)):
+            if i not in self.reader.cache:
+                return i
+        return None
+
+    # Prefetch thread: decode and scale the frames of the window into the reader cache, sleeps while it is full
+    def prefetch(self):
+        while True:
+            with self.condition:
+                index = self.next_missing()
+                while self.running and index is None:
+                    self.condition.wait()
+                    index = self.next_missing()
+                if not self.running:
+                    return
+                width, height = self.display_size
+            self.reader.display_frame(index, width, height)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout=1)
@@ -0,0 +1,215 @@
+"""
+Run SkyScope detection on folders of videos and images without the GUI
+
+Usage:
+    $ python batch_detect.py --weights best.pt --source footage/ --output results/
+    $ python batch_detect.py --weights best.onnx --source footage/ photos/ --output results/ --jobs 2 --location Site1
+
+Every file is written as <location>_<serialnum>_<name>_detection.mp4/.png like the GUI, videos with their per-frame
+detections in a <location>_<serialnum>_<name>_detection.det folder (DetectionStore.py), and a JSON summary of the run is
+saved to <output>/summary.json. Files found in subfolders with --recursive keep their folder in the name
+(a/clip.mp4 -> <location>_<serialnum>_a_clip_detection.mp4), files that would still share an output are skipped
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+import torch
+
+from Detector import Detector
+from DetectionPipeline import VideoDetectionPipeline, detect_image
+from DetectionStore import sidecar_path
+from utils.dataloaders import IMG_FORMATS, VID_FORMATS
+
+_detector = None  # Detector loaded once per process by init_worker
+
+
+def init_worker(config, threads):
+    global _detector
+    torch.set_num_threads(threads)  # share the cores between the jobs
+    _detector = Detector(**config)
+    _detector.warmup()
+
+
+def find_media(sources, recursive=False):
+    # Image and video files in the given files and folders, sorted per folder, with their path relative to the folder
+    files = []
+    for source in sources:
+        p = Path(source)
+        if p.is_dir():
+            found = p.rglob('*') if recursive else p.glob('*')
+            files += sorted((x, x.relative_to(p)) for x in found if x.suffix[1:].lower() in IMG_FORMATS + VID_FORMATS)
+        elif p.is_file():
+            files.append((p, Path(p.name)))
+        else:
+            print(f'{source}: not found, skipped')
+    return files
+
+
+def output_path(source, output, location='', serialnum='', relative=None):
+    # Files in subfolders keep their folder in the name, i.e. a/clip.mp4 -> a_clip_detection.mp4
+    ext = '.png' if source.suffix[1:].lower() in IMG_FORMATS else '.mp4'
+    stem = '_'.join((relative or Path(source.name)).with_suffix('').parts)
+    name = '_'.join(x for x in (location, serialnum, stem) if x)
+    return Path(output) / f'{name}_detection{ext}'
+
+
+def process(source, output, batch_size=4, queue_size=4, sidecar=True):
+    # Detect one file with the process detector, returns its summary entry
+    t = time.time()
+    result = {'source': str(source), 'output': str(output), 'frames': 0, 'seconds': 0.0, 'fps': 0.0, 'error': None}
+    try:
+        if source.suffix[1:].lower() in IMG_FORMATS:
+            detect_image(_detector, str(source), str(output))
+            result['frames'] = 1
+        else:
+            result['sidecar'] = sidecar_path(str(output)) if sidecar else None
+            pipeline = VideoDetectionPipeline(_detector, str(source), str(output), batch_size=batch_size,
+                                              queue_size=queue_size, sidecar=result['sidecar'])
+            result['frames'] = pipeline.run()
+            result['skipped'] = pipeline.skipped
+            if _detector.track: result['counts'] = pipeline.counts  # unique tracked objects per class
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.time() - t
+    result['fps'] = result['frames'] / result['seconds'] if result['seconds'] > 0 else 0.0
+    return result
+
+
+def log(results, total):
+    r = results[-1]
+    status = r['error'] or f"{r['frames']} frames, {r['fps']:.1f} FPS"
+    print(f"[{len(results)}/{total}] {r['source']}: {status}")
+
+
+def run(
+        weights='best.pt',  # model path (.pt, .onnx or _openvino_model folder)
+        source=('.',),  # files and folders of images and videos
+        output='results',  # folder for the annotated files and summary.json
+        imgsz=(416, 416),  # inference size (height, width)
+        conf_thres=0.25,  # confidence threshold
+        iou_thres=0.45,  # NMS IOU threshold
+        max_det=1000,  # maximum detections per image
+        classes=None,  # filter by class: --classes 0, or --classes 0 2 3
+        agnostic_nms=False,  # class-agnostic NMS
+        device='cpu',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+        dnn=False,  # use OpenCV DNN for ONNX inference
+        batch_size=4,  # frames per inference batch for videos
+        queue_size=4,  # batches buffered between the decode, inference and encode stages
+        jobs=1,  # files processed at the same time, each job is a process with its own model
+        threads=0,  # torch threads per job, 0 splits the cores between the jobs
+        location='',  # output name prefix, like the GUI location field
+        serialnum='',  # output name prefix, like the GUI serial number field
+        recursive=False,  # search the source folders recursively
+        sidecar=True,  # write the per-frame detections of every video
+        tile=False,  # detect on overlapping imgsz tiles at native resolution for small objects
+        tile_overlap=0.2,  # minimum overlap between neighbouring tiles (fraction of the tile size)
+        tile_min_std=0.0,  # skip tiles with a lower grey level standard deviation, 0 runs all tiles
+        motion_threshold=0.0,  # mean grey level change below which a video frame reuses the last detections, 0 off
+        motion_max_skip=10,  # frames in a row that reuse detections before inference is forced
+        track=False,  # track objects across video frames and count the unique objects per class
+        track_stride=1,  # detect every track_stride video frames, boxes are interpolated between them
+):
+    t = time.time()
+    media = find_media(source, recursive)
+    os.makedirs(output, exist_ok=True)
+
+    # Files that would overwrite the output of an earlier file are rejected
+    outputs, files, rejected = {}, [], []
+    for f, relative in media:
+        out = output_path(f, output, location, serialnum, relative)
+        if out in outputs:
+            rejected.append({'source': str(f), 'output': str(out), 'frames': 0, 'seconds': 0.0, 'fps': 0.0,
+                             'error': f'same output as {outputs[out]}'})
+            print(f'{f}: skipped, same output as {outputs[out]}')
+        else:
+            outputs[out] = f
+            files.append((f, out))
+    config = dict(weights=weights, device=device, imgsz=imgsz, conf_thres=conf_thres, iou_thres=iou_thres,
+                  max_det=max_det, classes=classes, agnostic_nms=agnostic_nms, dnn=dnn, tile=tile,
+                  tile_overlap=tile_overlap, tile_min_std=tile_min_std, motion_threshold=motion_threshold,
+                  motion_max_skip=motion_max_skip, track=track, track_stride=track_stride)
+    jobs = max(1, min(jobs, len(files)))
+    threads = threads or max(1, (os.cpu_count() or 1) // jobs)
+    print(f'Detecting {len(files)} files with {weights}, {jobs} job(s) x {threads} thread(s)')
+
+    results = []
+    if jobs > 1:
+        with ProcessPoolExecutor(jobs, mp_context=get_context('spawn'), initializer=init_worker,
+                                 initargs=(config, threads)) as pool:
+            futures = [pool.submit(process, f, out, batch_size, queue_size, sidecar) for f, out in files]
+            for future in as_completed(futures):
+                results.append(future.result())
+                log(results, len(files))
+    else:
+        init_worker(config, threads)
+        for f, out in files:
+            results.append(process(f, out, batch_size, queue_size, sidecar))
+            log(results, len(files))
+
+    # Summary
+    order = [str(f) for f, _ in media]
+    results = sorted(results + rejected, key=lambda x: order.index(x['source']))
+    seconds = time.time() - t
+    frames = sum(x['frames'] for x in results)
+    summary = {
+        'weights': str(weights),
+        'settings': {k: v for k, v in config.items() if k != 'weights'},
+        'jobs': jobs,
+        'threads': threads,
+        'files': len(media),
+        'failed': sum(x['error'] is not None for x in results),
+        'frames': frames,
+        'skipped': sum(x.get('skipped', 0) for x in results),  # video frames that reused detections (motion gate)
+        'seconds': seconds,
+        'fps': frames / seconds if seconds > 0 else 0.0,
+        'results': results}
+    f = Path(output) / 'summary.json'
+    with open(f, 'w') as file:
+        json.dump(summary, file, indent=2)
+    print(f"Done: {len(media)} files, {frames} frames in {seconds:.1f}s ({summary['fps']:.1f} FPS), "
+          f"{summary['failed']} failed. Summary saved to {f}")
+    return summary
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='best.pt', help='model path (.pt, .onnx or _openvino_model)')
+    parser.add_argument('--source', nargs='+', type=str, default=['.'], help='files and folders of images and videos')
+    parser.add_argument('--output', type=str, default='results', help='folder for the annotated files and summary')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs='+', type=int, default=[416, 416], help='image (h, w)')
+    parser.add_argument('--conf-thres', type=float, default=0.25, help='confidence threshold')
+    parser.add_argument('--iou-thres', type=float, default=0.45, help='NMS IoU threshold')
+    parser.add_argument('--max-det', type=int, default=1000, help='maximum detections per image')
+    parser.add_argument('--classes', nargs='+', type=int, help='filter by class: --classes 0, or --classes 0 2 3')
+    parser.add_argument('--agnostic-nms', action='store_true', help='class-agnostic NMS')
+    parser.add_argument('--device', default='cpu', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
+    parser.add_argument('--dnn', action='store_true', help='use OpenCV DNN for ONNX inference')
+    parser.add_argument('--batch-size', type=int, default=4, help='frames per inference batch for videos')
+    parser.add_argument('--queue-size', type=int, default=4, help='batches buffered between pipeline stages')
+    parser.add_argument('--jobs', type=int, default=1, help='files processed at the same time')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads per job, 0 splits the cores')
+    parser.add_argument('--location', type=str, default='', help='output name prefix')
+    parser.add_argument('--serialnum', type=str, default='', help='output name prefix')
+    parser.add_argument('--recursive', action='store_true', help='search the source folders recursively')
+    parser.add_argument('--no-sidecar', dest='sidecar', action='store_false', help='skip the per-frame detections')
+    parser.add_argument('--tile', action='store_true', help='tiled inference at native resolution for small objects')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='minimum overlap between neighbouring tiles')
+    parser.add_argument('--tile-min-std', type=float, default=0.0, help='skip tiles with less grey level std, 0 runs all')
+    parser.add_argument('--motion-threshold', type=float, default=0.0, help='reuse detections below this frame change')
+    parser.add_argument('--motion-max-skip', type=int, default=10, help='frames in a row that reuse detections')
+    parser.add_argument('--track', action='store_true', help='track objects and count unique objects per video')
+    parser.add_argument('--track-stride', type=int, default=1, help='detect every n-th frame when tracking')
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    return opt
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    run(**vars(opt))
@@ -0,0 +1,238 @@
+"""
+Benchmark SkyScope processing paths on this machine, old path vs new path
+
+Usage:
+    $ python benchmark.py --weights best.pt --source inspection.mp4 --include warmup
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import torch
+
+from Detector import Detector
+from DetectionPipeline import VideoDetectionPipeline
+from utils.augmentations import letterbox
+from utils.general import cv2
+from LiveStream import ColourAdjuster
+from VideoPlayer import FrameReader
+
+
+def load_frames(source, n, size=(1920, 1080)):
+    # Read the first n frames of a video, or make n random frames of the given (width, height) if no source is given
+    if not source:
+        return [np.random.randint(0, 255, (size[1], size[0], 3), dtype=np.uint8) for _ in range(n)]
+    cap = cv2.VideoCapture(source)
+    frames = []
+    while len(frames) < n:
+        ret, frame = cap.read()
+        if not ret: break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def bench_warmup(weights, frames, imgsz):
+    # Per-frame rate with a warmup pass before every frame vs a single warmup per loaded model. DetectMultiBackend
+    # only warms up on GPU, on CPU the old per-frame warmup returns at once and both paths run at about the same rate
+    detector = Detector(weights, imgsz=imgsz)
+    buffer = detector.input_buffer(1)
+    if detector.device.type == 'cpu':
+        print('warmup: DetectMultiBackend.warmup() is a no-op on CPU, expect a speedup of about 1.0')
+
+    t = time.time()
+    for frame in frames:
+        detector.model.warmup(imgsz=(1, 3, *detector.imgsz))  # old: warmup before every frame
+        detector.predict(*detector.preprocess([frame], buffer))
+    before = len(frames) / (time.time() - t)
+
+    detector.warmup()
+    t = time.time()
+    for frame in frames:
+        detector.predict(*detector.preprocess([frame], buffer))
+    after = len(frames) / (time.time() - t)
+    return ['warmup', 'FPS', before, after, after / before]
+
+
+def bench_seek(source, n):
+    # CPU time per displayed frame with a seek before every frame vs sequential decode
+    cap = cv2.VideoCapture(source)
+    t = time.process_time()
+    for i in range(n):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, i)  # old: seek on every timer tick
+        if cap.grab(): cap.retrieve()
+    before = (time.process_time() - t) / n * 1E3
+    cap.release()
+
+    reader = FrameReader(source)
+    t = time.process_time()
+    for i in range(n):
+        reader.read(i)
+    after = (time.process_time() - t) / n * 1E3
+    reader.release()
+    return ['seek', 'CPU ms/frame', before, after, before / after]
+
+
+def allocated_mb(fn):
+    # MB allocated while fn runs: numpy/OpenCV arrays through tracemalloc, torch tensors through the profiler
+    tracemalloc.start()
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tensors = sum(e.cpu_memory_usage for e in prof.events() if e.cpu_memory_usage > 0)
+    return (peak + tensors) / 1E6
+
+
+def bench_preprocess(weights, frames, imgsz, batch_size=4):
+    # Frames to model input, old resize/letterbox/transpose/stack/float/255 chain vs one pass into a reused tensor
+    detector = Detector(weights, imgsz=imgsz)
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+
+    def old(batch):
+        ims = []
+        for frame in batch:
+            im = cv2.resize(frame, (detector.imgsz[1], detector.imgsz[0]), interpolation=cv2.INTER_AREA)
+            im = letterbox(im, detector.imgsz, stride=detector.stride, auto=detector.pt)[0]
+            ims.append(np.ascontiguousarray(im.transpose((2, 0, 1))[::-1]))
+        im = torch.from_numpy(np.stack(ims))
+        im = im.half() if detector.model.fp16 else im.float()
+        im /= 255
+        return im
+
+    buffer = detector.input_buffer(batch_size)
+
+    def new(batch):
+        return detector.preprocess(batch, buffer)[0]
+
+    results = []
+    for fn in (old, new):
+        t = time.time()
+        for batch in batches:
+            fn(batch)
+        ms = (time.time() - t) / len(frames) * 1E3
+        mb = sum(allocated_mb(lambda: fn(batch)) for batch in batches) / len(frames)
+        results.append((ms, mb))
+    (ms0, mb0), (ms1, mb1) = results
+    return [['preprocess', 'ms/frame', ms0, ms1, ms0 / ms1],
+            ['preprocess', 'allocated MB/frame', mb0, mb1, mb0 / mb1 if mb1 else float('inf')]]
+
+
+def bench_output(weights, frames, imgsz):
+    # Detection output of the frames as a video and of the first frame as an image, old 416px re-encode with a cubic
+    # upsampled second PNG write vs annotating the original frames with boxes mapped through scale_boxes
+    detector = Detector(weights, imgsz=imgsz)
+    detector.warmup()
+    buffer = detector.input_buffer(1)
+    height, width = frames[0].shape[:2]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in ('old', 'new'):
+            video, image = os.path.join(tmp, f'{path}.mp4'), os.path.join(tmp, f'{path}.png')
+            size = (width, height) if path == 'new' else (detector.imgsz[1], detector.imgsz[0])
+            t = time.time()
+            writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*'mp4v'), 30, size)
+            for i, frame in enumerate(frames):
+                if path == 'old':
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)  # old: inference size output
+                im0 = detector.annotate(frame, detector.predict(*detector.preprocess([frame], buffer))[0])
+                writer.write(im0)
+                if i == 0:
+                    cv2.imwrite(image, im0)
+                    if path == 'old':  # old: upsample the annotated image and write it again
+                        cv2.imwrite(image, cv2.resize(im0, (width, height), interpolation=cv2.INTER_CUBIC))
+            writer.release()
+            results.append(((time.time() - t) / len(frames) * 1E3, (os.path.getsize(video) + os.path.getsize(image)) / 1E6))
+    (ms0, mb0), (ms1, mb1) = results
+    return [['output', 'ms/frame', ms0, ms1, ms0 / ms1],
+            ['output', 'MB written', mb0, mb1, mb0 / mb1]]
+
+
+def bench_motion(weights, source, imgsz, threshold=2.0, max_skip=10):
+    # Video detection FPS inferring every frame vs the motion gate reusing detections on near duplicate frames
+    fps = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for motion_threshold in (0.0, threshold):
+            detector = Detector(weights, imgsz=imgsz, motion_threshold=motion_threshold, motion_max_skip=max_skip)
+            detector.warmup()
+            pipeline = VideoDetectionPipeline(detector, source, os.path.join(tmp, f'{motion_threshold}.mp4'))
+            t = time.time()
+            frames = pipeline.run()
+            fps.append(frames / (time.time() - t))
+    print(f'motion: {pipeline.skipped} of {frames} frames reused detections')
+    return ['motion', 'FPS', fps[0], fps[1], fps[1] / fps[0]]
+
+
+def bench_colour(frames, brightness=20, contrast=30, saturation=15):
+    # Live stream colour adjustment, old per-frame chain vs lookup tables into preallocated buffers
+    frames = [cv2.resize(f, (1100, 600)) for f in frames]  # live stream size
+
+    t = time.time()
+    for frame in frames:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        frame = cv2.convertScaleAbs(frame, alpha=(contrast/255.0+1), beta=brightness)
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2HSV)
+        h, s, v = cv2.split(frame)
+        s = cv2.add(s, saturation)
+        frame = cv2.merge((h, s, v))
+        frame = cv2.cvtColor(frame, cv2.COLOR_HSV2RGB)
+        frame = cv2.GaussianBlur(frame, (3,3), 0)
+    before = (time.time() - t) / len(frames) * 1E3
+
+    adjuster = ColourAdjuster()
+    t = time.time()
+    for frame in frames:
+        adjuster.apply(frame, brightness, contrast, saturation)
+    after = (time.time() - t) / len(frames) * 1E3
+    return ['colour', 'ms/frame', before, after, before / after]
+
+
+def run(weights='best.pt', source='', imgsz=(416, 416), frames=50, batch_size=4, include=('warmup',)):
+    frames = load_frames(source, frames)
+    results = []
+    if 'warmup' in include:
+        results.append(bench_warmup(weights, frames, imgsz))
+    if 'seek' in include:
+        if source:
+            results.append(bench_seek(source, len(frames)))
+        else:
+            print('seek: skipped, requires --source video')
+
+    if 'colour' in include:
+        results.append(bench_colour(frames))
+    if 'preprocess' in include:
+        results.extend(bench_preprocess(weights, frames, imgsz, batch_size))
+    if 'output' in include:
+        results.extend(bench_output(weights, frames, imgsz))
+    if 'motion' in include:
+        if source:
+            results.append(bench_motion(weights, source, imgsz))
+        else:
+            print('motion: skipped, requires --source video')
+
+    df = pd.DataFrame(results, columns=['Benchmark', 'Unit', 'Before', 'After', 'Speedup'])
+    print(f'\nBenchmarks complete on {len(frames)} frames\n{df.round(3).to_string(index=False)}')
+    return df
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='best.pt', help='model.pt path')
+    parser.add_argument('--source', type=str, default='', help='video file, random frames if empty')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs='+', type=int, default=[416, 416], help='image (h, w)')
+    parser.add_argument('--frames', type=int, default=50, help='number of frames to benchmark on')
+    parser.add_argument('--batch-size', type=int, default=4, help='frames per preprocess batch')
+    parser.add_argument('--include', nargs='+', default=['warmup'], help='warmup, seek, colour, preprocess, output, motion')
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    return opt
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    run(**vars(opt))
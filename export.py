@@ -23,6 +23,9 @@ Requirements:
 
 Usage:
     $ python export.py --weights yolov5s.pt --include torchscript onnx openvino engine coreml tflite ...
+    $ python export.py --weights best.pt --imgsz 416 --include onnx openvino --int8 --calib frames/  # INT8 ONNX/OpenVINO
+    $ python export.py --weights best.pt --imgsz 416 --include onnx --nms  # ONNX with NMS, best-nms.onnx
+    $ python export.py --weights a.pt b.pt --include onnx openvino tflite --workers 2  # weights in parallel
 
 Inference:
     $ python detect.py --weights yolov5s.pt                 # PyTorch
@@ -54,10 +57,14 @@ import subprocess
 import sys
 import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import torch
+import torchvision
 from torch.utils.mobile_optimizer import optimize_for_mobile
 
 FILE = Path(__file__).resolve()
@@ -96,6 +103,26 @@ class iOSModel(torch.nn.Module):
         return cls * conf, xywh * self.normalize  # confidence (3780, 80), coordinates (3780, 4)
 
 
+class ONNXNMSModel(torch.nn.Module):
+    # YOLOv5 model with box decoding, confidence filtering and NMS in the exported graph, batch size 1
+
+    def __init__(self, model, conf_thres=0.25, iou_thres=0.45, topk=100, agnostic_nms=False):
+        super().__init__()
+        self.model = model
+        self.conf_thres, self.iou_thres, self.topk = conf_thres, iou_thres, topk
+        self.max_wh = 0 if agnostic_nms else 7680  # class offset, boxes of different classes never overlap
+
+    def forward(self, x):
+        p = self.model(x)[0][0]  # (anchors, 5 + nc) xywh, objectness, class scores
+        scores, cls = (p[:, 5:] * p[:, 4:5]).max(1)  # conf = obj_conf * cls_conf of the best class
+        keep = scores > self.conf_thres
+        p, scores, cls = p[keep], scores[keep], cls[keep].float()
+        xy, wh = p[:, :2], p[:, 2:4] / 2
+        boxes = torch.cat((xy - wh, xy + wh), 1)  # xywh to xyxy
+        i = torchvision.ops.nms(boxes + cls[:, None] * self.max_wh, scores, self.iou_thres)[:self.topk]
+        return torch.cat((boxes[i], scores[i, None], cls[i, None]), 1)  # (n, 6) xyxy, conf, cls
+
+
 def export_formats():
     # YOLOv5 export formats
     x = [
@@ -114,6 +141,30 @@ def export_formats():
     return pd.DataFrame(x, columns=['Format', 'Argument', 'Suffix', 'CPU', 'GPU'])
 
 
+FORMAT_DEPENDENCIES = {  # --include format: intermediate formats it is built from
+    'engine': ('onnx',),
+    'openvino': ('onnx',),
+    'pb': ('saved_model',),
+    'tflite': ('saved_model',),
+    'edgetpu': ('tflite',),
+    'tfjs': ('pb',),}
+
+
+def export_plan(include):
+    # Formats to build for include in dependency order, every shared intermediate once
+    plan = []
+
+    def visit(x):
+        for d in FORMAT_DEPENDENCIES.get(x, ()):
+            visit(d)
+        if x not in plan:
+            plan.append(x)
+
+    for x in include:
+        visit(x)
+    return plan
+
+
 def try_export(inner_func):
     # YOLOv5 export decorator, i..e @try_export
     inner_args = get_default_args(inner_func)
@@ -205,27 +256,203 @@ def export_onnx(model, im, file, opset, dynamic, simplify, prefix=colorstr('ONNX
 
 
 @try_export
-def export_openvino(file, metadata, half, prefix=colorstr('OpenVINO:')):
-    # YOLOv5 OpenVINO export
+def export_onnx_nms(model, im, file, opset, conf_thres, iou_thres, topk, agnostic_nms, prefix=colorstr('ONNX NMS:')):
+    # YOLOv5 ONNX export with NMS in the graph, fixed input shape, outputs (n, 6) xyxy, conf, cls per image
+    check_requirements('onnx>=1.12.0')
+    import onnx
+
+    assert im.shape[0] == 1, 'ONNX NMS export requires --batch-size 1'
+    LOGGER.info(f'\n{prefix} starting export with onnx {onnx.__version__}...')
+    f = str(file).replace('.pt', '-nms.onnx')
+
+    torch.onnx.export(
+        ONNXNMSModel(model, conf_thres, iou_thres, topk, agnostic_nms),
+        im,
+        f,
+        verbose=False,
+        opset_version=max(opset, 11),  # NonMaxSuppression requires opset 11
+        do_constant_folding=True,
+        input_names=['images'],
+        output_names=['output0'],
+        dynamic_axes={'output0': {0: 'detections'}})
+
+    # Checks
+    model_onnx = onnx.load(f)  # load onnx model
+    onnx.checker.check_model(model_onnx)  # check onnx model
+
+    # Metadata
+    d = {'stride': int(max(model.stride)), 'names': model.names, 'nms': True, 'conf_thres': conf_thres,
+         'iou_thres': iou_thres, 'topk': topk}
+    for k, v in d.items():
+        meta = model_onnx.metadata_props.add()
+        meta.key, meta.value = k, str(v)
+    onnx.save(model_onnx, f)
+    return f, model_onnx
+
+
+@try_export
+def export_onnx_int8(file, im, stride, calib, calib_frames, prefix=colorstr('ONNX INT8:')):
+    # YOLOv5 ONNX Runtime INT8 post-training static quantization, calibrated on the images/videos in calib
+    check_requirements(('onnx>=1.12.0', 'onnxruntime'))
+    import onnx
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    LOGGER.info(f'\n{prefix} starting quantization with onnxruntime {onnxruntime.__version__}...')
+    f = str(file).replace('.pt', '-int8.onnx')
+    f_fp32 = file.with_suffix('.onnx')
+
+    class Calibration(CalibrationDataReader):
+        # Feeds up to calib_frames letterboxed frames to the calibrator, tiled to the exported batch size
+        def __init__(self):
+            self.dataset = iter(LoadImages(calib, img_size=list(im.shape[2:]), stride=stride, auto=False))
+            self.n = 0
+
+        def get_next(self):
+            item = next(self.dataset, None) if self.n < calib_frames else None
+            if item is None:
+                return None
+            self.n += 1
+            x = item[1][None].astype(np.float32) / 255  # uint8 CHW to float32 BCHW 0.0 - 1.0
+            return {'images': np.repeat(x, im.shape[0], axis=0)}
+
+    calibration = Calibration()
+    quantize_static(str(f_fp32),
+                    f,
+                    calibration,
+                    quant_format=QuantFormat.QDQ,  # QDQ models also convert to INT8 OpenVINO IR
+                    op_types_to_quantize=['Conv'],  # Detect() box decoding stays FP32
+                    per_channel=True,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8)
+    assert calibration.n, f'no calibration images found in {calib}'
+    LOGGER.info(f'{prefix} calibrated on {calibration.n} images from {calib}')
+
+    # Metadata
+    model_onnx, model_fp32 = onnx.load(f), onnx.load(f_fp32)
+    del model_onnx.metadata_props[:]
+    model_onnx.metadata_props.extend(model_fp32.metadata_props)  # stride and names
+    onnx.save(model_onnx, f)
+    return f, model_onnx
+
+
+@try_export
+def export_openvino(file, metadata, half, int8=False, prefix=colorstr('OpenVINO:')):
+    # YOLOv5 OpenVINO export, int8 converts the quantized ONNX model from export_onnx_int8()
     check_requirements('openvino-dev')  # requires openvino-dev: https://pypi.org/project/openvino-dev/
     import openvino.inference_engine as ie
 
-    LOGGER.info(f'\n{prefix} starting export with openvino {ie.__version__}...')
-    f = str(file).replace('.pt', f'_openvino_model{os.sep}')
+    LOGGER.info(f'\n{prefix} starting {"INT8 " if int8 else ""}export with openvino {ie.__version__}...')
+    f_onnx = Path(str(file).replace('.pt', '-int8.onnx')) if int8 else file.with_suffix('.onnx')
+    f = str(file).replace('.pt', f'_int8_openvino_model{os.sep}' if int8 else f'_openvino_model{os.sep}')
 
     args = [
         'mo',
         '--input_model',
-        str(file.with_suffix('.onnx')),
+        str(f_onnx),
         '--output_dir',
         f,
         '--data_type',
         ('FP16' if half else 'FP32'),]
     subprocess.run(args, check=True, env=os.environ)  # export
-    yaml_save(Path(f) / file.with_suffix('.yaml').name, metadata)  # add metadata.yaml
+    yaml_save(Path(f) / f_onnx.with_suffix('.yaml').name, metadata)  # add metadata.yaml
     return f, None
 
 
+def benchmark_latency(w, im, n=50):
+    # Mean forward pass latency (ms) of a PyTorch or exported model on im
+    from models.common import DetectMultiBackend
+
+    model = DetectMultiBackend(w, device=im.device)
+    model.warmup(imgsz=tuple(im.shape))
+    t = time.perf_counter()
+    for _ in range(n):
+        model(im)
+    return (time.perf_counter() - t) / n * 1E3
+
+
+def benchmark_batch(model, im, batch, n=20):
+    # Mean forward pass latency (ms) of a batch of images, fixed batch models run it in padded chunks of len(im)
+    x = im[:1].expand(batch, *im.shape[1:]).contiguous()
+    chunks = [x]
+    try:
+        model(x)
+    except Exception:
+        b = len(im)  # exported batch size
+        chunks = [x[i:i + b] for i in range(0, batch, b)]
+        chunks[-1] = torch.cat([chunks[-1], x[:b - len(chunks[-1])]])  # pad the last chunk
+        model(chunks[0])
+    t = time.perf_counter()
+    for _ in range(n):
+        for c in chunks:
+            model(c)
+    return (time.perf_counter() - t) / n * 1E3
+
+
+@try_export
+def export_verification(file, files, im, y, half, batch=8, prefix=colorstr('Verification:')):
+    # Output parity of every exported model against PyTorch output y on im, and latency at batch 1 and batch
+    from models.common import DetectMultiBackend
+
+    LOGGER.info(f'\n{prefix} verifying {len(files)} export(s) against {file}...')
+    suffixes = export_formats()[['Format', 'Suffix']].values
+    y = (y[0] if isinstance(y, (list, tuple)) else y).float().cpu()
+    rows = []
+    for w in [str(file), *files]:
+        name = Path(w).name
+        fmt = max((x for x in suffixes if x[1] in name), key=lambda x: len(x[1]))[0] + (' INT8' if 'int8' in name else '')
+        box, conf, t1, tn = (float('nan'),) * 4
+        try:
+            model = DetectMultiBackend(w, device=im.device, fp16=half)
+            p = model(im)
+            p = (p[0] if isinstance(p, (list, tuple)) else p).float().cpu()
+            if p.shape == y.shape:
+                box = (p[..., :4] - y[..., :4]).abs().max().item()  # pixels
+                conf = (p[..., 4:] - y[..., 4:]).abs().max().item()
+            else:
+                LOGGER.info(f'{prefix} {fmt} output shape {tuple(p.shape)} differs from PyTorch {tuple(y.shape)}')
+            t1 = benchmark_batch(model, im, 1)
+            tn = benchmark_batch(model, im, batch)
+        except Exception as e:
+            LOGGER.info(f'{prefix} {fmt} verification failure ❌: {e}')
+        rows.append([fmt, name, file_size(w), box, conf, box < 1 and conf < 1E-2, t1, tn, batch / tn * 1E3])
+
+    df = pd.DataFrame(rows,
+                      columns=[
+                          'Format', 'File', 'Size (MB)', 'Box diff (px)', 'Conf diff', 'Parity', 'Latency bs1 (ms)',
+                          f'Latency bs{batch} (ms)', f'Throughput bs{batch} (img/s)'])
+    f = file.with_name(f'{file.stem}_exports.csv')
+    df.to_csv(f, index=False)
+    LOGGER.info(f'\n{df.round(4).to_string(index=False)}')
+    return f, df
+
+
+@try_export
+def export_int8_report(file, files, im, data, prefix=colorstr('INT8 report:')):
+    # Latency and mAP of the INT8 models against the FP32 PyTorch model, saved next to the weights
+    LOGGER.info(f'\n{prefix} comparing {len(files)} INT8 model(s) against {file}...')
+    rows = []
+    for w in [file, *files]:
+        latency = benchmark_latency(w, im)
+        try:
+            import val as validate  # YOLOv5 val.py
+            map50, map = validate.run(data, weights=w, batch_size=1, imgsz=im.shape[2], device=im.device,
+                                      plots=False)[0][2:4]
+        except Exception as e:
+            LOGGER.info(f'{prefix} mAP unavailable for {w}: {e}')
+            map50, map = float('nan'), float('nan')
+        rows.append([Path(w).name, latency, map50, map])
+
+    df = pd.DataFrame(rows, columns=['Model', 'Latency (ms)', 'mAP50', 'mAP50-95'])
+    df['Latency delta (ms)'] = df['Latency (ms)'] - df['Latency (ms)'][0]
+    df['mAP50 delta'] = df['mAP50'] - df['mAP50'][0]
+    df['mAP50-95 delta'] = df['mAP50-95'] - df['mAP50-95'][0]
+    f = file.with_name(f'{file.stem}-int8_report.csv')
+    df.to_csv(f, index=False)
+    LOGGER.info(f'\n{df.round(4).to_string(index=False)}')
+    return f, df
+
+
 @try_export
 def export_paddle(model, im, file, metadata, prefix=colorstr('PaddlePaddle:')):
     # YOLOv5 Paddle export
@@ -267,8 +494,17 @@ def export_coreml(model, im, file, int8, half, nms, prefix=colorstr('CoreML:')):
 
 
 @try_export
-def export_engine(model, im, file, half, dynamic, simplify, workspace=4, verbose=False, prefix=colorstr('TensorRT:')):
-    # YOLOv5 TensorRT export https://developer.nvidia.com/tensorrt
+def export_engine(model,
+                  im,
+                  file,
+                  half,
+                  dynamic,
+                  simplify,
+                  workspace=4,
+                  verbose=False,
+                  onnx_exported=False,
+                  prefix=colorstr('TensorRT:')):
+    # YOLOv5 TensorRT export https://developer.nvidia.com/tensorrt, onnx_exported reuses an opset 12 ONNX model
     assert im.device.type != 'cpu', 'export running on CPU but must be on GPU, i.e. `python export.py --device 0`'
     try:
         import tensorrt as trt
@@ -284,7 +520,8 @@ def export_engine(model, im, file, half, dynamic, simplify, workspace=4, verbose
         model.model[-1].anchor_grid = grid
     else:  # TensorRT >= 8
         check_version(trt.__version__, '8.0.0', hard=True)  # require tensorrt>=8.0.0
-        export_onnx(model, im, file, 12, dynamic, simplify)  # opset 12
+        if not onnx_exported:
+            export_onnx(model, im, file, 12, dynamic, simplify)  # opset 12
     onnx = file.with_suffix('.onnx')
 
     LOGGER.info(f'\n{prefix} starting export with TensorRT {trt.__version__}...')
@@ -662,18 +899,22 @@ def run(
         inplace=False,  # set YOLOv5 Detect() inplace=True
         keras=False,  # use Keras
         optimize=False,  # TorchScript: optimize for mobile
-        int8=False,  # CoreML/TF INT8 quantization
+        int8=False,  # CoreML/TF/ONNX/OpenVINO INT8 quantization
+        calib=None,  # ONNX/OpenVINO INT8: calibration images/videos, defaults to the data.yaml train images
+        calib_frames=300,  # ONNX/OpenVINO INT8: maximum calibration images
         dynamic=False,  # ONNX/TF/TensorRT: dynamic axes
         simplify=False,  # ONNX: simplify model
         opset=12,  # ONNX: opset version
         verbose=False,  # TensorRT: verbose log
         workspace=4,  # TensorRT: workspace size (GB)
-        nms=False,  # TF: add NMS to model
+        nms=False,  # TF/ONNX: add NMS to model
         agnostic_nms=False,  # TF: add agnostic NMS to model
         topk_per_class=100,  # TF.js NMS: topk per class to keep
-        topk_all=100,  # TF.js NMS: topk for all classes to keep
-        iou_thres=0.45,  # TF.js NMS: IoU threshold
-        conf_thres=0.25,  # TF.js NMS: confidence threshold
+        topk_all=100,  # TF.js/ONNX NMS: topk for all classes to keep
+        iou_thres=0.45,  # TF.js/ONNX NMS: IoU threshold
+        conf_thres=0.25,  # TF.js/ONNX NMS: confidence threshold
+        verify=True,  # check every export against PyTorch and time it
+        verify_batch=8,  # verification: batch size of the throughput run
 ):
     t = time.time()
     include = [x.lower() for x in include]  # to lowercase
@@ -681,6 +922,7 @@ def run(
     flags = [x in include for x in fmts]
     assert sum(flags) == len(include), f'ERROR: Invalid --include {include}, valid --include arguments are {fmts}'
     jit, onnx, xml, engine, coreml, saved_model, pb, tflite, edgetpu, tfjs, paddle = flags  # export booleans
+    plan = export_plan(include)  # requested formats and their intermediates, each built once
     file = Path(url2file(weights) if str(weights).startswith(('http:/', 'https:/')) else weights)  # PyTorch weights
 
     # Load PyTorch model
@@ -710,6 +952,9 @@ def run(
 
     for _ in range(2):
         y = model(im)  # dry runs
+    if verify:
+        im_verify = torch.rand(im.shape, generator=torch.Generator().manual_seed(0)).to(device)  # same input for every format
+        y_verify = model(im_verify)  # FP32 PyTorch reference
     if half and not coreml:
         im, model = im.half(), model.half()  # to FP16
     shape = tuple((y[0] if isinstance(y, tuple) else y).shape)  # model output shape
@@ -721,17 +966,34 @@ def run(
     warnings.filterwarnings(action='ignore', category=torch.jit.TracerWarning)  # suppress TracerWarning
     if jit:  # TorchScript
         f[0], _ = export_torchscript(model, im, file, optimize)
-    if engine:  # TensorRT required before ONNX
-        f[1], _ = export_engine(model, im, file, half, dynamic, simplify, workspace, verbose)
-    if onnx or xml:  # OpenVINO requires ONNX
+    if 'onnx' in plan:  # shared by ONNX, OpenVINO and TensorRT
+        if engine and opset != 12:
+            LOGGER.info(f'{colorstr("ONNX:")} exporting opset 12 instead of {opset}, shared with TensorRT')
+            opset = 12
         f[2], _ = export_onnx(model, im, file, opset, dynamic, simplify)
+    if engine:  # TensorRT
+        f[1], _ = export_engine(model, im, file, half, dynamic, simplify, workspace, verbose, onnx_exported=bool(f[2]))
     if xml:  # OpenVINO
         f[3], _ = export_openvino(file, metadata, half)
+    f_int8 = []  # ONNX/OpenVINO INT8 models
+    if int8 and (onnx or xml) and f[2]:  # INT8 OpenVINO requires INT8 ONNX
+        calib = calib or check_dataset(check_yaml(data))['train']
+        f_onnx_int8, _ = export_onnx_int8(file, im, gs, calib, calib_frames)
+        if f_onnx_int8:
+            f_int8.append(f_onnx_int8)
+            if xml:
+                f_int8.append(export_openvino(file, metadata, half, int8=True)[0])
+        f_int8 = [x for x in f_int8 if x]
+        if f_int8:
+            export_int8_report(file, f_int8, im, data)
+    f_nms = None  # ONNX with NMS in the graph
+    if onnx and nms:
+        f_nms, _ = export_onnx_nms(model, im, file, opset, conf_thres, iou_thres, topk_all, agnostic_nms)
     if coreml:  # CoreML
         f[4], ct_model = export_coreml(model, im, file, int8, half, nms)
         if nms:
             pipeline_coreml(ct_model, im, file, model.names, y)
-    if any((saved_model, pb, tflite, edgetpu, tfjs)):  # TensorFlow formats
+    if 'saved_model' in plan:  # TensorFlow formats
         assert not tflite or not tfjs, 'TFLite and TF.js models must be exported separately, please pass only one type.'
         assert not isinstance(model, ClassificationModel), 'ClassificationModel export to TF formats not yet supported.'
         f[5], s_model = export_saved_model(model.cpu(),
@@ -745,9 +1007,9 @@ def run(
                                            iou_thres=iou_thres,
                                            conf_thres=conf_thres,
                                            keras=keras)
-        if pb or tfjs:  # pb prerequisite to tfjs
+        if 'pb' in plan:  # pb prerequisite to tfjs
             f[6], _ = export_pb(s_model, file)
-        if tflite or edgetpu:
+        if 'tflite' in plan:
             f[7], _ = export_tflite(s_model, im, file, int8 or edgetpu, data=data, nms=nms, agnostic_nms=agnostic_nms)
             if edgetpu:
                 f[8], _ = export_edgetpu(file)
@@ -758,7 +1020,9 @@ def run(
         f[10], _ = export_paddle(model, im, file, metadata)
 
     # Finish
-    f = [str(x) for x in f if x]  # filter out '' and None
+    f = [str(x) for x in f + f_int8 + [f_nms] if x]  # filter out '' and None
+    if verify and f:
+        export_verification(file, f, im_verify.half() if half else im_verify, y_verify, half, verify_batch)
     if any(f):
         cls, det, seg = (isinstance(model, x) for x in (ClassificationModel, DetectionModel, SegmentationModel))  # type
         det &= not seg  # segmentation models inherit from SegmentationModel(DetectionModel)
@@ -786,18 +1050,23 @@ def parse_opt(known=False):
     parser.add_argument('--inplace', action='store_true', help='set YOLOv5 Detect() inplace=True')
     parser.add_argument('--keras', action='store_true', help='TF: use Keras')
     parser.add_argument('--optimize', action='store_true', help='TorchScript: optimize for mobile')
-    parser.add_argument('--int8', action='store_true', help='CoreML/TF INT8 quantization')
+    parser.add_argument('--int8', action='store_true', help='CoreML/TF/ONNX/OpenVINO INT8 quantization')
+    parser.add_argument('--calib', type=str, default=None, help='ONNX/OpenVINO INT8: calibration images/videos folder')
+    parser.add_argument('--calib-frames', type=int, default=300, help='ONNX/OpenVINO INT8: maximum calibration images')
     parser.add_argument('--dynamic', action='store_true', help='ONNX/TF/TensorRT: dynamic axes')
     parser.add_argument('--simplify', action='store_true', help='ONNX: simplify model')
     parser.add_argument('--opset', type=int, default=17, help='ONNX: opset version')
     parser.add_argument('--verbose', action='store_true', help='TensorRT: verbose log')
     parser.add_argument('--workspace', type=int, default=4, help='TensorRT: workspace size (GB)')
-    parser.add_argument('--nms', action='store_true', help='TF: add NMS to model')
+    parser.add_argument('--nms', action='store_true', help='TF/ONNX: add NMS to model')
     parser.add_argument('--agnostic-nms', action='store_true', help='TF: add agnostic NMS to model')
     parser.add_argument('--topk-per-class', type=int, default=100, help='TF.js NMS: topk per class to keep')
-    parser.add_argument('--topk-all', type=int, default=100, help='TF.js NMS: topk for all classes to keep')
-    parser.add_argument('--iou-thres', type=float, default=0.45, help='TF.js NMS: IoU threshold')
-    parser.add_argument('--conf-thres', type=float, default=0.25, help='TF.js NMS: confidence threshold')
+    parser.add_argument('--topk-all', type=int, default=100, help='TF.js/ONNX NMS: topk for all classes to keep')
+    parser.add_argument('--iou-thres', type=float, default=0.45, help='TF.js/ONNX NMS: IoU threshold')
+    parser.add_argument('--conf-thres', type=float, default=0.25, help='TF.js/ONNX NMS: confidence threshold')
+    parser.add_argument('--no-verify', dest='verify', action='store_false', help='skip export verification')
+    parser.add_argument('--verify-batch', type=int, default=8, help='verification: batch size of the throughput run')
+    parser.add_argument('--workers', type=int, default=1, help='parallel export processes, one weights file each')
     parser.add_argument(
         '--include',
         nargs='+',
@@ -808,9 +1077,25 @@ def parse_opt(known=False):
     return opt
 
 
+def init_export_worker(threads):
+    torch.set_num_threads(threads)  # share the cores between the export processes
+
+
 def main(opt):
-    for opt.weights in (opt.weights if isinstance(opt.weights, list) else [opt.weights]):
-        run(**vars(opt))
+    # Export every weights file, independent weights run in parallel worker processes
+    t = time.time()
+    weights = opt.weights if isinstance(opt.weights, list) else [opt.weights]
+    kwargs = {k: v for k, v in vars(opt).items() if k not in ('weights', 'workers')}
+    LOGGER.info(f"Export plan: {' -> '.join(export_plan([x.lower() for x in opt.include]))}")
+    n = max(1, min(opt.workers, len(weights)))
+    if n > 1:
+        threads = max(1, (os.cpu_count() or 1) // n)
+        with ProcessPoolExecutor(n, mp_context=get_context('spawn'), initializer=init_export_worker,
+                                 initargs=(threads,)) as pool:
+            files = [x.result() for x in [pool.submit(run, weights=w, **kwargs) for w in weights]]
+    else:
+        files = [run(weights=w, **kwargs) for w in weights]
+    LOGGER.info(f'\nExported {len(weights)} weights to {sum(len(x) for x in files)} files in {time.time() - t:.1f}s total')
 
 
 if __name__ == '__main__':
@@ -7,26 +7,37 @@ from PyQt5.QtMultimediaWidgets import *
 
 from datetime import datetime
 from ControlClient import ClientRequests
-
-from models.common import DetectMultiBackend
-from utils.general import (check_img_size, cv2, non_max_suppression, scale_boxes)
-from utils.plots import Annotator, colors
+from Detector import Detector
+from BackendSelector import BACKENDS, BackendSelector
+from DetectionPipeline import (ShardedVideoDetection, VideoDetectionPipeline, detect_image, render_image, render_video,
+                               resumable_frames)
+from DetectionStore import DetectionReader, sidecar_path
+from ResultCache import ResultCache
+from VideoPlayer import FramePrefetcher, FrameReader
+from LiveStream import LiveStreamPipeline
+
+from utils.general import cv2
 from utils.torch_utils import select_device
-from utils.augmentations import letterbox
 
 import sys
 import time
 import os
-import torch
+import shutil
 import threading
 import socket
-import numpy as np
 import ctypes
+import multiprocessing
 
 myappid = u'skyscopeID' # arbitrary string
 ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
 class MainWindow(QtWidgets.QMainWindow):
+    streamFrameReady = pyqtSignal(object)  # processed live stream frame for the GUI thread
+    streamInterrupted = pyqtSignal(str)  # camera or processing failure in the live stream threads
+    predictionProgress = pyqtSignal(int, int)  # frames done and total frames of the detection run for the GUI thread
+    shardProgress = pyqtSignal(list, list)  # frames done and frames of every shard of a sharded detection run
+    predictionStatus = pyqtSignal(str)  # model status at the end of a detection run
+
     def __init__(self):
         super(QtWidgets.QMainWindow, self).__init__()
         uic.loadUi("MainWindow.ui", self) #load ui file
@@ -77,22 +88,30 @@ class MainWindow(QtWidgets.QMainWindow):
         self.playVidButton.clicked.connect(self.playPauseVideoEvent)
         self.captureButton.clicked.connect(self.captureButtonEvent)
         self.runButton.clicked.connect(self.runButtonEvent)
+        self.predictionProgress.connect(self.updatePredictionProgress)
+        self.shardProgress.connect(self.updateShardProgress)
+        self.predictionStatus.connect(self.modelStatus.setText)
         self.newFile.clicked.connect(self.newFileButtonEvent)
-        self.modelButton.clicked.connect(self.load_model) # Import model detect.pt (CPU Only)
+        self.modelButton.clicked.connect(self.load_model) # Import model best.pt, .onnx or OpenVINO .xml (CPU Only)
 
         # Initialize the video player variables
         self.cap = None
+        self.prefetcher = None
         self.total_frames = 0
         self.fps = 0
         self.timer = None
         self.paused = False
         self.current_frame = 0
+        self.frame_cache_mb = 256  # memory limit of the decoded frame cache (MB)
+        self.prefetch_depth = 16  # frames decoded ahead of the frame on display at normal speed
         self.newFile.setEnabled(False)
         self.fileType.currentIndexChanged.connect(self.fileTypeChanged)
 
         # Stream tab initializations
         self.camera = None
-        self.streamThread = None
+        self.streamPipeline = None  # capture, processing and display stages of the live stream
+        self.streamFrameReady.connect(self.displayStreamFrame)
+        self.streamInterrupted.connect(self.handleStreamInterrupted)
         self.ipAddrText.setVisible(False) #remove IP Addr text box by default
         self.is_recording = False # initialize recording state
         self.ip_text_edit = self.findChild(QtWidgets.QTextEdit, "ipAddrText")
@@ -107,6 +126,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.captureStream.clicked.connect(self.captureStreamEvent)
         self.stopStream.clicked.connect(self.stopStreamEvent)
         self.startStream.clicked.connect(self.startStreamEvent)
+        self.liveDetectionBox.toggled.connect(self.liveDetectionEvent)
 
         # Search for available cameras
         self.available_cameras = QCameraInfo.availableCameras() 
@@ -117,6 +137,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         # Recording update elapsed time
         self.recordTime.setVisible(False)
+        self.detectionStats.setVisible(False)
         self.timer = QTimer() #timer for video frames update
         self.timer1 = QTimer() #recording elapsed time
         
@@ -129,6 +150,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.conf_thres=0.25  # confidence threshold
         self.iou_thres=0.45  # NMS IOU threshold
         self.max_det=1000  # maximum detections per image
+        self.batch_size=4  # frames per inference batch for video detection
+        self.queue_size=4  # batches buffered between the decode, inference and encode stages
+        self.shard_workers=0  # worker processes for sharded video detection (0 or 1 runs the threaded pipeline)
+        self.save_detections=True  # write the per-frame detections next to the detection video (.det folder)
+        self.use_result_cache=True  # reuse the detections of an earlier run on the same media, model and settings
+        self.result_cache_mb=2048  # size limit of the result cache in the project folder (MB)
+        self.resultCache=None
+        self.checkpoint_every=300  # frames between checkpoints of a video run, an interrupted run can resume from them
+        self.resumeRun=False  # continue the interrupted run of the selected video
         self.device = select_device('cpu')  # cuda cpu device
         self.classes=None  # filter by class: --class 0, or --class 0 2 3
         self.agnostic_nms=False  # class-agnostic NMS
@@ -140,7 +170,17 @@ class MainWindow(QtWidgets.QMainWindow):
         self.hide_conf=False  # hide confidences
         self.half=False  # use FP16 half-precision inference
         self.dnn=False  # use OpenCV DNN for ONNX inference
-        self.model=None  # model file
+        self.tile=False  # tiled inference: detect on overlapping imgsz tiles at native resolution for small objects
+        self.tile_overlap=0.2  # minimum overlap between neighbouring tiles (fraction of the tile size)
+        self.tile_min_std=0.0  # skip tiles with a lower grey level standard deviation (sky, bare ground), 0 runs all
+        self.motion_threshold=0.0  # video frames changing less than this mean grey level (0-255) reuse detections, 0 off
+        self.motion_max_skip=10  # frames in a row that reuse detections before inference is forced
+        self.track=False  # track objects across video frames and count the unique objects per class
+        self.track_stride=1  # detect every track_stride video frames, boxes are interpolated between them
+        self.trackCounts=None  # (video, unique objects per class name) of the last tracked run
+        self.backend='auto'  # backend for .pt models: 'auto' benchmarks them on load, or pin one of BackendSelector.BACKENDS
+        self.backendSelector = BackendSelector(os.path.join(self.baseDir, 'backend_cache.json'))  # timings per machine and model
+        self.model=None  # loaded Detector (model file and inference settings)
         self.data = os.path.join(self.baseDir, 'data/coco128.yaml') # dataset.yaml path
 
 
@@ -402,7 +442,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.open_video()
             else: #clear video capture initialization before importing image
                 if self.cap:
-                  self.cap.release()
+                  self.releaseVideo()
                   self.total_frames = 0
                   self.fps = 0
                   self.current_frame = 0
@@ -448,9 +488,11 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.videoAvailable = True
 
                 # Load the video and display it in the label
-                self.cap = cv2.VideoCapture(self.video_source)
-                self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
+                if self.cap: self.releaseVideo()
+                self.cap = FrameReader(self.video_source, cache_mb=self.frame_cache_mb)  # sequential decode, seeks only on jumps
+                self.prefetcher = FramePrefetcher(self.cap, depth=self.prefetch_depth)  # decodes upcoming frames off the GUI thread
+                self.total_frames = self.cap.total_frames
+                self.fps = self.cap.fps
 
                 self.scrubberBar.setRange(0, self.total_frames - 1)
                 self.scrubberBar.setTickInterval(int(self.total_frames / 10))
@@ -464,6 +506,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 # Calculate the initial interval of timer based on the value of speedSlider
                 ratio = self.speedSlider.value() / (self.speedSlider.maximum() - self.speedSlider.minimum())
                 self.timer.setInterval(int((1000 // self.fps) / ratio))
+                self.prefetcher.set_speed(ratio)
 
                 if self.paused == True: 
                     self.playPauseVideoEvent()
@@ -498,20 +541,18 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def updateMediaLabel(self):
         if self.cap:
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame)
-            
-            success = self.cap.grab()
+            # Served from the frame cache when the frame was shown recently, otherwise decoded in order
+            # during playback (scrubber and skip jumps seek) and scaled to the label
+            rgb_image = self.cap.display_frame(self.current_frame, self.mediaLabel.width(), self.mediaLabel.height())
 
-            # Retrieve the grabbed frame
-            if success:
-                _, frame = self.cap.retrieve()
-            
-                # Perform further processing with the frame
-                rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # Let the prefetch thread prepare the frames after this one
+            if self.prefetcher:
+                self.prefetcher.seek(self.current_frame, self.mediaLabel.width(), self.mediaLabel.height())
+
+            if rgb_image is not None:
                 h, w, ch = rgb_image.shape
-                qimage = QImage(rgb_image.data, w, h, QImage.Format_RGB888)
-                scaled_qimage = qimage.scaled(self.mediaLabel.width(), self.mediaLabel.height(), Qt.KeepAspectRatio)
-                self.mediaLabel.setPixmap(QPixmap.fromImage(scaled_qimage))
+                qimage = QImage(rgb_image.data, w, h, ch * w, QImage.Format_RGB888)
+                self.mediaLabel.setPixmap(QPixmap.fromImage(qimage))
                 self.mediaLabel.setAlignment(Qt.AlignCenter)
 
 
@@ -520,6 +561,15 @@ class MainWindow(QtWidgets.QMainWindow):
         ratio = value / (self.speedSlider.maximum() - self.speedSlider.minimum())
         new_interval = int((1000 // self.fps) / ratio)
         self.timer.setInterval(new_interval)
+        if self.prefetcher:
+            self.prefetcher.set_speed(ratio)
+
+
+    def releaseVideo(self):
+        if self.prefetcher:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        self.cap.release()
 
 
     def skipFootageEvent(self):
@@ -595,16 +645,23 @@ class MainWindow(QtWidgets.QMainWindow):
         layout1.addWidget(self.spinbox3)
         layout.addLayout(layout1)
 
+        # Prefill the counts with the unique objects tracked in the last detection run on this video
+        if self.fileType.currentIndex() == 0 and self.trackCounts and self.trackCounts[0] == self.video_source:
+            for spinbox, keys in ((self.spinbox1, ('leaf', 'leaves')), (self.spinbox2, ('fruit',)),
+                                  (self.spinbox3, ('branch',))):
+                n = sum(v for name, v in self.trackCounts[1].items() if any(k in name.lower() for k in keys))
+                spinbox.setMaximum(max(spinbox.maximum(), n))
+                spinbox.setValue(n)
+
         if self.fileType.currentIndex() == 1:  #import image
             frame = cv2.imread(self.image_source)
+            rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         else:
             if self.cap:
-                # Capture the current frame
-                self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame)
-                ret, frame = self.cap.read()
+                # Capture the current frame, already in the frame cache since it is on display
+                rgb_image = self.cap.display_frame(self.current_frame, self.mediaLabel.width(), self.mediaLabel.height())
     
         # Convert the frame to a QImage
-        rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         h, w, ch = rgb_image.shape
         bytes_per_line = ch * w
         qimage = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888)
@@ -654,21 +711,47 @@ class MainWindow(QtWidgets.QMainWindow):
     def load_model(self): #load model CPU only
         try:
             temp_model, _ = QFileDialog.getOpenFileName(self, 'Load YOLOv5 Model', '',
-                                            "PyTorch Checkpoint (*.pt)")
+                                            "YOLOv5 Models (*.pt *.onnx *.xml);;PyTorch Checkpoint (*.pt);;"
+                                            "ONNX Runtime (*.onnx);;OpenVINO IR (*.xml)")
+            if temp_model and temp_model.endswith('.xml'):
+                temp_model = os.path.dirname(temp_model)  # OpenVINO models load from their _openvino_model folder
             if temp_model:
-                self.model = DetectMultiBackend(temp_model, device=select_device('cpu'), dnn=self.dnn,
-                                                data=self.data, fp16=self.half)
-                self.stride, self.names, self.pt = self.model.stride, self.model.names, self.model.pt
-                self.imgsz = check_img_size(self.imgsz, s=self.stride)  # check image size
+                if self.backend != 'auto' and self.backend not in BACKENDS: raise Exception(f"Unknown backend {self.backend}")
+                self.modelStatus.setVisible(True)
+                QApplication.setOverrideCursor(Qt.WaitCursor)
+                try:
+                    self.model = self.backendSelector.select(temp_model, self.makeDetector, self.imgsz, pin=self.backend,
+                                                             progress=self.backendProgress)
+                finally:
+                    QApplication.restoreOverrideCursor()
                 if temp_model: self.modelLoaded = True  #signal that model has been loaded
+                latency = self.model.benchmark()  # warmup and per-frame latency of the active backend
                 self.modelStatus.setVisible(True)
-                self.modelStatus.setText(f'Model Loaded: {os.path.basename(temp_model)}')
+                self.modelStatus.setText(f'Model Loaded: {os.path.basename(temp_model)} | '
+                                         f'{self.model.backend}{" + NMS" if self.model.nms else ""} {latency * 1E3:.1f} ms/frame')
+                if self.streamPipeline is not None and self.liveDetectionBox.isChecked():
+                    self.streamPipeline.set_detector(self.model)  # live detection switches to the new model
             
         except Exception as e:
             self.modelStatus.setVisible(False)
             QMessageBox.warning(self, "Error", f"{e}")
             return
 
+    # Build a Detector with the current YOLOv5 variables, dnn overrides self.dnn
+    def makeDetector(self, weights, dnn=None):
+        return Detector(weights, device=self.device, data=self.data, imgsz=self.imgsz,
+                        conf_thres=self.conf_thres, iou_thres=self.iou_thres, max_det=self.max_det,
+                        classes=self.classes, agnostic_nms=self.agnostic_nms, augment=self.augment,
+                        visualize=self.visualize, line_thickness=self.line_thickness,
+                        hide_labels=self.hide_labels, hide_conf=self.hide_conf, half=self.half,
+                        dnn=self.dnn if dnn is None else dnn, tile=self.tile, tile_overlap=self.tile_overlap,
+                        tile_min_std=self.tile_min_std, motion_threshold=self.motion_threshold,
+                        motion_max_skip=self.motion_max_skip, track=self.track, track_stride=self.track_stride)
+
+    def backendProgress(self, message):
+        self.modelStatus.setText(message)
+        QApplication.processEvents()  # selection runs on the GUI thread, keep the status label painted
+
 
     def runButtonEvent(self):
         try:
@@ -684,6 +767,15 @@ class MainWindow(QtWidgets.QMainWindow):
                 if self.fileType.currentIndex() == 0:
                     if not self.paused:
                         self.playPauseVideoEvent()
+
+                    # Offer to continue an interrupted run of this video from its last checkpoint
+                    self.resumeRun = False
+                    resume_frames = resumable_frames(sidecar_path(self.outputPath(False)), self.video_source, self.model)
+                    if resume_frames:
+                        reply = QMessageBox.question(self, "Resume Detection",
+                                                     f"Detection of this video was interrupted after {resume_frames} frames. "
+                                                     f"Resume from there?", QMessageBox.Yes | QMessageBox.No)
+                        self.resumeRun = reply == QMessageBox.Yes
             
             # Start prediction thread if from idle state, else forcefully finish the thread
             if not self.predictionThread.is_alive() or self.predictionThread is None:
@@ -699,108 +791,126 @@ class MainWindow(QtWidgets.QMainWindow):
     # Target function for the prediction thread, this function will start the prediction for the selected image/video
     def runPrediction(self):
         try:
-            cap = None
-            video_writer = None
-            newHeight = 416
-            newWidth = 416
             current_frame = 0
-            ret = None
-            isImage = False
-
-            if self.fileType.currentIndex() == 1:
-                image_file_name = os.path.splitext(os.path.basename(self.image_source))[0]
-                filename = "{}_{}_{}_detection.png".format(self.location, self.serialnum, image_file_name)
-                file_path = os.path.join(self.directory, filename)
-                frame = cv2.imread(self.image_source)
-                total_frames = 1
-                isImage = True
+            skipped = 0
+            counts = None  # unique tracked objects per class name
+            isImage = self.fileType.currentIndex() == 1
+            batch_size = 1 if isImage else max(1, int(self.batch_size))
+            source = self.image_source if isImage else self.video_source
+            start_time = time.time()
+            self.model.tile_counts.update(run=0, skipped=0)
+
+            # Look up the detections of an earlier run on the same media, model and settings
+            cache_key, cached = None, None
+            if self.use_result_cache:
+                if self.resultCache is None:
+                    self.resultCache = ResultCache(os.path.join(self.project_path, '.cache'), self.result_cache_mb)
+                cache_key = self.resultCache.key(source, self.model)
+                cached = self.resultCache.get(cache_key)
+
+            # Warmup once per loaded model, later runs on the same model skip it
+            if cached is None:
+                warmup_time = self.model.warmup(bs=batch_size)
+                if warmup_time: print(f'Model warmup took {warmup_time:.2f}s')
+
+            file_path = self.outputPath(isImage)
+            sidecar = sidecar_path(file_path) if self.save_detections or cache_key or not isImage else None
+
+            if cached is not None and not self.resumeRun:
+                # Redraw the output from the cached detections instead of running the model
+                reader = DetectionReader(cached)
+                if isImage:
+                    render_image(self.model, source, file_path, reader.frame(0))
+                    current_frame = 1
+                else:
+                    current_frame = render_video(self.model, source, file_path, reader,
+                                                 progress=self.predictionProgress.emit,
+                                                 stop=lambda: self.predictionThreadFinished)
+                if self.save_detections: shutil.copytree(cached, sidecar, dirs_exist_ok=True)
+                sidecar = None
+                print(f'Detections loaded from the result cache {cached}')
+                counts = reader.meta.get('counts')
+            elif isImage:
+                # Save the processed photo to file_path
+                detect_image(self.model, source, file_path, sidecar)
+                current_frame = 1
             else:
-                video_file_name = os.path.splitext(os.path.basename(self.video_source))[0]
-                filename = "{}_{}_{}_detection.mp4".format(self.location, self.serialnum, video_file_name)
-                file_path = os.path.join(self.directory, filename)
-                cap = cv2.VideoCapture(self.video_source)
-                ret, frame = cap.read()
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                # Create video writer
-                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                video_writer = cv2.VideoWriter(file_path, fourcc, fps, (newWidth, newHeight))
-
-            height, width, _ = frame.shape
-            
-            # Write each frame to the video write
-            while current_frame < total_frames and not self.predictionThreadFinished:
-                if ret or isImage:
-                    resized_frame = cv2.resize(frame, (416, 416), interpolation=cv2.INTER_AREA)
-                    bs = 1  # batch_size
-                    self.model.warmup(imgsz=(1 if self.pt else bs, 3, *self.imgsz))  # warmup
-                    
-                    im = letterbox(resized_frame, (416, 416), stride=32, auto=self.pt)[0]
-                    im = im.transpose((2, 0, 1))[::-1]
-                    im = np.ascontiguousarray(im)
-                    im = torch.from_numpy(im).to(self.device)
-                    im = im.half() if self.model.fp16 else im.float()  # uint8 to fp16/32
-                    im /= 255  # 0 - 255 to 0.0 - 1.0
-                    if len(im.shape) == 3:
-                        im = im[None]  # expand for batch dim
-    
-                    # Inference
-                    self.pred = self.model(im, augment=self.augment, visualize=self.visualize)
-    
-                    # NMS
-                    self.pred = non_max_suppression(self.pred, self.conf_thres, self.iou_thres, self.classes, self.agnostic_nms, max_det=self.max_det)
-
-                    # Process predictions
-                    for i, det in enumerate(self.pred):  # per image
-                        im0 = resized_frame.copy()
-                        annotator = Annotator(im0, line_width=self.line_thickness, example=str(self.names))
-    
-                        if len(det):
-                            # Rescale boxes from img_size to im0 size
-                            det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
-                                
-                            # Write results
-                            for *xyxy, conf, cls in reversed(det):
-                                c = int(cls)  # integer class
-                                label = None if self.hide_labels else (self.names[c] if self.hide_conf else f'{self.names[c]} {conf:.2f}')
-                                annotator.box_label(xyxy, label, color=colors(c, True))
-                else: pass
-
-                if self.fileType.currentIndex() == 0:
-                    # Write the resized frame to the video writer
-                    video_writer.write(im0)
-                    ret, frame = cap.read()
-
-                if self.fileType.currentIndex() == 1:
-                    # Save the processed photo to file_path
-                    cv2.imwrite(file_path, im0)
-                    original_image = cv2.resize(im0, (width, height), interpolation=cv2.INTER_CUBIC)
-                    cv2.imwrite(file_path, original_image)
-                
-                current_frame = current_frame + 1
-
-            if cap:
-                # Release the video capture and video writer
-                cap.release()
-                video_writer.release()
+                if self.shard_workers > 1 and self.track:
+                    print(f'shard_workers={self.shard_workers} ignored, tracked runs detect the frames in order')
+                if self.shard_workers > 1 and not self.resumeRun and not self.track:
+                    # Split the video into frame ranges detected by separate worker processes
+                    # (tracking follows objects through the frames in order, tracked runs use the pipeline below)
+                    pipeline = ShardedVideoDetection(self.model, self.video_source, file_path, workers=self.shard_workers,
+                                                     batch_size=batch_size, progress=self.shardProgress.emit,
+                                                     stop=lambda: self.predictionThreadFinished, sidecar=sidecar)
+                else:
+                    # Decode, detect and encode on separate stages connected by bounded queues
+                    # Checkpoints the detections every checkpoint_every frames, resumeRun continues from the last one
+                    pipeline = VideoDetectionPipeline(self.model, self.video_source, file_path, batch_size=batch_size,
+                                                      queue_size=self.queue_size, progress=self.predictionProgress.emit,
+                                                      stop=lambda: self.predictionThreadFinished, sidecar=sidecar,
+                                                      resume=self.resumeRun, checkpoint_every=self.checkpoint_every)
+                current_frame = pipeline.run()
+                skipped = pipeline.skipped
+                counts = pipeline.counts if self.track else None
+
+            # Keep the detections of a complete run in the result cache
+            if sidecar:
+                complete = DetectionReader(sidecar).meta['complete']
+                if cache_key and complete:
+                    self.resultCache.put(cache_key, sidecar)
+                if not self.save_detections and complete: shutil.rmtree(sidecar, ignore_errors=True)  # keep checkpoints
+            self.resumeRun = False
+
+            # Report the detection throughput
+            elapsed = time.time() - start_time
+            throughput = current_frame / elapsed if elapsed > 0 else 0.0
+            self.predictionStatus.emit(f'Model Loaded: {os.path.basename(self.model.weights)} | '
+                                       f'{"Result cache" if cached else self.model.backend} '
+                                       f'{throughput:.1f} FPS (batch size {batch_size})')
+            print(f'Processed {current_frame} frames in {elapsed:.1f}s ({throughput:.1f} FPS, batch size {batch_size})')
+            if skipped:
+                print(f'Motion gate: {skipped} of {current_frame} frames reused the detections of the last inferred frame')
+            if counts is not None and not isImage:
+                self.trackCounts = (source, counts)
+                print(f'Unique objects: {counts}')
+            tiles = self.model.tile_counts
+            if self.model.tile and any(tiles.values()):  # counted in this process, not by shard workers
+                print(f"Tiled inference: {tiles['run']} tiles detected, {tiles['skipped']} low texture tiles skipped")
             self.runButton.setText(f'Run Detection')
             self.predictionThreadFinished = True
             print('Prediction thread is finished running')
             return
 
         except Exception as e:
-            if cap is not None:
-                if cap.isOpened(): 
-                    cap.release()
-            if video_writer is not None:
-                if video_writer.isOpened():
-                    video_writer.release()
             self.runButton.setText(f'Run Detection')
             self.predictionThreadFinished = True
             print(f'Prediction thread encountered an error: {e}')
             return  
 
 
+    # Output file of the detection run on the selected image or video
+    def outputPath(self, isImage):
+        source = self.image_source if isImage else self.video_source
+        file_name = os.path.splitext(os.path.basename(source))[0]
+        filename = "{}_{}_{}_detection.{}".format(self.location, self.serialnum, file_name, 'png' if isImage else 'mp4')
+        return os.path.join(self.directory, filename)
+
+
+    # Slot of predictionProgress, runs on the GUI thread
+    def updatePredictionProgress(self, frames_done, total_frames):
+        if not self.predictionThreadFinished:
+            self.runButton.setText(f'Stop Processing ({int(100 * frames_done / max(total_frames, 1))}%)')
+
+
+    # Slot of shardProgress, runs on the GUI thread
+    def updateShardProgress(self, frames_done, shard_sizes):
+        self.updatePredictionProgress(sum(frames_done), sum(shard_sizes))
+        if not self.predictionThreadFinished:
+            shards = ' | '.join(f'{int(100 * d / max(n, 1))}%' for d, n in zip(frames_done, shard_sizes))
+            self.modelStatus.setText(f'Model Loaded: {os.path.basename(self.model.weights)} | Shards: {shards}')
+
+
     def handleTabChange(self):
         if self.widget1.currentIndex() == 2:
              if self.cameraComboBox.currentIndex() == 1:
@@ -829,44 +939,57 @@ class MainWindow(QtWidgets.QMainWindow):
             QMessageBox.warning(self, "Error setting the camera", f"{e}")
 
 
-    def update_image(self):
-        streamInterrupted = False
-        while self.isStreaming and not streamInterrupted:
-            try:
-                ret, frame = self.camera.read()
-                if ret:
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Apply the brightness, saturation, and contrast adjustments to the frame
-                    brightness = self.brightnessSlider.value()
-                    saturation = self.saturationSlider.value()
-                    contrast = self.contrastSlider.value()
-                    
-                    frame = cv2.convertScaleAbs(frame, alpha=(contrast/255.0+1), beta=brightness) #127.0
-                    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2HSV)
-                    h, s, v = cv2.split(frame)
-                    s = cv2.add(s, saturation)
-                    frame = cv2.merge((h, s, v))
-                    frame = cv2.cvtColor(frame, cv2.COLOR_HSV2RGB)
-                    frame = cv2.GaussianBlur(frame, (3,3), 0) 
-
-                    # if recording button is toggled, start recording
-                    if self.is_recording:
-                        recframe = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                        if self.video_writer.isOpened():
-                            self.video_writer.write(recframe)
-
-                    size = self.streamLabel.size()
-                    # Convert the frame to a QImage and display it in the window
-                    self.image = QImage(frame.data, frame.shape[1], frame.shape[0], QImage.Format_RGB888)
-                    self.streamLabel.setPixmap(QPixmap.fromImage(self.image).scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
-            
-            except Exception as e:
-                print(f"Stream Interrupted: {e}")        
-                streamInterrupted = True
-                self.stopStreamEvent(fromThread=True)
-                return
-        return
+    def streamSettings(self):
+        return self.brightnessSlider.value(), self.contrastSlider.value(), self.saturationSlider.value()
+
+
+    def streamDisplaySize(self):
+        size = self.streamLabel.size()
+        return max(1, size.width()), max(1, size.height())
+
+
+    # Runs on the processing thread, records the adjusted frame if recording button is toggled
+    def recordStreamFrame(self, frame):
+        if self.is_recording:
+            recframe = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            if self.video_writer.isOpened():
+                self.video_writer.write(recframe)
+
+
+    # Slot of streamFrameReady, runs on the GUI thread
+    def displayStreamFrame(self, frame):
+        pipeline = self.streamPipeline
+        if pipeline is None: return
+        if not self.isStreaming:
+            pipeline.displayed(painted=False)
+            return
+
+        # Convert the frame to a QImage and display it in the window
+        h, w, ch = frame.shape
+        self.image = QImage(frame.data, w, h, ch * w, QImage.Format_RGB888)
+        self.streamLabel.setPixmap(QPixmap.fromImage(self.image))
+        pipeline.displayed()
+        self.streamLabel.setToolTip(pipeline.stats())
+        if pipeline.detector is not None:
+            self.detectionStats.setText(pipeline.detection_stats())
+
+
+    # Live detection runs the loaded model on the stream and draws its latest boxes over newer frames
+    def liveDetectionEvent(self, checked):
+        if checked and not self.modelLoaded:
+            QMessageBox.warning(self, "Error", "Model not loaded")
+            self.liveDetectionBox.setChecked(False)
+            return
+        self.detectionStats.setText("Detection: ")
+        self.detectionStats.setVisible(checked)
+        if self.streamPipeline is not None:
+            self.streamPipeline.set_detector(self.model if checked else None)
+
+
+    # Slot of streamInterrupted, runs on the GUI thread
+    def handleStreamInterrupted(self, message):
+        print(f"Stream Interrupted: {message}")
+        self.stopStreamEvent(fromThread=True)
     
 
     def recordStreamEvent(self, fromThread=False):
@@ -962,6 +1085,12 @@ class MainWindow(QtWidgets.QMainWindow):
             if self.isStreaming == False and self.widget1.currentIndex() == 2: 
                 raise Exception("Start stream first")
             
+            #stop the stream threads before the recorder they write to is released
+            if self.streamPipeline is not None:
+                self.streamPipeline.stop()
+                print(f"Stream stopped: {self.streamPipeline.stats()}")
+                self.streamPipeline = None
+
             #handle recording if stop is triggered 
             if self.is_recording: 
                 self.recordStreamEvent(fromThread)
@@ -1015,9 +1144,11 @@ class MainWindow(QtWidgets.QMainWindow):
             self.startStream.setEnabled(False)
 
             self.isStreaming = True
-            self.streamThread = threading.Thread(target=self.update_image)
-            self.streamThread.daemon = True
-            self.streamThread.start()
+            self.streamPipeline = LiveStreamPipeline(self.camera, self.streamSettings, self.streamFrameReady.emit,
+                                                     display_size=self.streamDisplaySize, record=self.recordStreamFrame,
+                                                     error=lambda e: self.streamInterrupted.emit(f"{e}"),
+                                                     detector=self.model if self.liveDetectionBox.isChecked() else None)
+            self.streamPipeline.start()
 
 
     def MoveWindow(self, event):
@@ -1052,6 +1183,7 @@ def show_main_window(window):
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # sharded detection workers in the frozen executable
     MainApp = QtWidgets.QApplication(sys.argv)
 
     SplashScreen = SplashScreen()
@@ -0,0 +1,75 @@
+import json
+import os
+
+import numpy as np
+
+from DetectionStore import DetectionReader, DetectionWriter
+
+
+# Frame i has i + 1 boxes of class i
+def frame(i):
+    det = np.zeros((i + 1, 6), dtype=np.float32)
+    det[:, :4] = np.arange(4) + 10 * i
+    det[:, 4] = 0.5
+    det[:, 5] = i
+    return det
+
+
+def write(path, frames, checkpoint=None, complete=False):
+    writer = DetectionWriter(str(path), 30, ['a', 'b', 'c', 'd'])
+    for i in range(frames):
+        writer.write(frame(i))
+        if i + 1 == checkpoint:
+            writer.checkpoint()
+    if complete:
+        writer.close()
+    else:
+        writer.flush()  # interrupted, the files stay open
+    return writer
+
+
+def truncate(path, column, rows, row_size):
+    with open(os.path.join(path, f'{column}.bin'), 'r+b') as f:
+        f.truncate(rows * row_size)
+
+
+def check(reader, frames):
+    assert len(reader) == frames
+    for i in range(frames):
+        np.testing.assert_array_equal(reader.frame(i)[:, :6], frame(i))
+
+
+def test_complete(tmp_path):
+    write(tmp_path, 4, complete=True)
+    reader = DetectionReader(str(tmp_path))
+    assert reader.meta['complete']
+    check(reader, 4)
+    assert len(reader.dataframe()) == 1 + 2 + 3 + 4
+
+
+def test_frames_after_checkpoint(tmp_path):
+    write(tmp_path, 4, checkpoint=2)
+    check(DetectionReader(str(tmp_path)), 2)
+
+
+def test_truncated_column(tmp_path):
+    # meta.json records 3 frames (6 rows) but only 4 rows of boxes reached the disk, frame 2 would lose 2 of its 3
+    write(tmp_path, 4, checkpoint=3)
+    truncate(tmp_path, 'xyxy', 4, 16)
+    check(DetectionReader(str(tmp_path)), 2)
+
+
+def test_truncated_index(tmp_path):
+    # The index lost the entry of frame 2, frame 1 has no known end
+    write(tmp_path, 3, complete=True)
+    truncate(tmp_path, 'index', 2, 8)
+    check(DetectionReader(str(tmp_path)), 1)
+
+
+def test_empty_column(tmp_path):
+    write(tmp_path, 3, complete=True)
+    with open(os.path.join(tmp_path, 'meta.json')) as f:
+        meta = json.load(f)
+    assert (meta['frames'], meta['rows']) == (3, 6)
+    truncate(tmp_path, 'conf', 0, 4)
+    check(DetectionReader(str(tmp_path)), 0)